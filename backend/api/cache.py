@@ -0,0 +1,36 @@
+from django.core.cache import cache
+from django.db import transaction
+
+RECIPE_PAYLOAD_TIMEOUT = 60 * 60
+RECIPE_PAYLOAD_VERSION = 2
+
+
+def recipe_payload_key(recipe_id):
+    return f'recipe-payload:v{RECIPE_PAYLOAD_VERSION}:{recipe_id}'
+
+
+def get_recipe_payloads(recipe_ids):
+    keys = {recipe_payload_key(pk): pk for pk in recipe_ids}
+    return {
+        keys[key]: payload
+        for key, payload in cache.get_many(keys).items()
+    }
+
+
+def set_recipe_payloads(payloads):
+    cache.set_many(
+        {recipe_payload_key(pk): payload for pk, payload in payloads.items()},
+        RECIPE_PAYLOAD_TIMEOUT
+    )
+
+
+def delete_recipe_payloads(recipe_ids):
+    cache.delete_many([recipe_payload_key(pk) for pk in recipe_ids])
+
+
+def invalidate_recipe_payloads(recipe_ids):
+    # A reader that rebuilt the payload before the commit would cache the old
+    # rows for RECIPE_PAYLOAD_TIMEOUT, so it is dropped once the change is
+    # visible.
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: delete_recipe_payloads(recipe_ids))
@@ -1,6 +1,24 @@
 import django_filters
+from django import forms
+from django.db.models import Count, Exists, OuterRef
+from django_filters.widgets import BaseCSVWidget
 
-from recipes.models import Ingredient, Recipe
+from recipes.models import (
+    FavoriteRecipes, Ingredient, Recipe, RecipeIngredient, ShoppingCart
+)
+
+
+class MultipleCSVWidget(BaseCSVWidget, forms.TextInput):
+    # Accepts both ?author=1,2 and ?author=1&author=2.
+    def value_from_datadict(self, data, files, name):
+        return [
+            part for value in data.getlist(name)
+            for part in value.split(',') if part
+        ]
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    pass
 
 
 class IngredientFilter(django_filters.FilterSet):
@@ -15,6 +33,15 @@ class IngredientFilter(django_filters.FilterSet):
 
 
 class RecipeFilter(django_filters.FilterSet):
+    author = NumberInFilter(
+        field_name='author',
+        widget=MultipleCSVWidget
+    )
+    ingredients = NumberInFilter(
+        method='filter_ingredients',
+        widget=MultipleCSVWidget
+    )
+    search = django_filters.CharFilter(method='filter_search')
     is_favorited = django_filters.NumberFilter(
         method='filter_is_favorited'
     )
@@ -24,23 +51,32 @@ class RecipeFilter(django_filters.FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ['author']
+        fields = ['author', 'ingredients']
 
-    def filter_is_favorited(self, queryset, name, value):
-        if self.value() == '1':
-            user = self.request.user
-            return queryset.filter(favorites__user=user)
-        elif self.value() == '0':
-            user = self.request.user
-            return queryset.exclude(favorites__user=user)
-        else:
+    def filter_by_user_relation(self, queryset, model, value):
+        user = self.request.user
+        if not user.is_authenticated or value not in (1, 0):
             return queryset
+        related = Exists(model.objects.filter(
+            user=user, recipe=OuterRef('pk')
+        ))
+        return queryset.filter(related if value else ~related)
+
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_by_user_relation(queryset, FavoriteRecipes, value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        if not user.is_authenticated or value not in (1, 0):
+        return self.filter_by_user_relation(queryset, ShoppingCart, value)
+
+    def filter_search(self, queryset, name, value):
+        return queryset.search(value)
+
+    def filter_ingredients(self, queryset, name, value):
+        ingredient_ids = set(value)
+        if not ingredient_ids:
             return queryset
-        if value:
-            return queryset.filter(shopping_carts__user=user)
-        else:
-            return queryset.exclude(shopping_carts__user=user)
+        return queryset.filter(pk__in=RecipeIngredient.objects.filter(
+            ingredient__in=ingredient_ids
+        ).values('recipe').annotate(
+            matched=Count('ingredient')
+        ).filter(matched=len(ingredient_ids)).values('recipe'))
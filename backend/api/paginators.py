@@ -1,7 +1,142 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from hashlib import md5
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    Cursor,
+    CursorPagination,
+    PageNumberPagination,
+)
+from rest_framework.response import Response
+
+PAGINATION_MODE_PARAM = 'pagination'
+CURSOR_PAGINATION_MODE = 'cursor'
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
     page_query_param = 'page'
+
+
+def keyset_filter(ordering, position):
+    # Rows strictly after position in ordering, i.e. the row comparison
+    # (a, b) > (x, y) spelled as a > x OR (a = x AND b > y). The leading
+    # a >= x bound lets the database start a range scan on the index.
+    condition = None
+    for field, value in reversed(list(zip(ordering, position))):
+        name = field.lstrip('-')
+        after = Q(**{f'{name}__{"lt" if field[0] == "-" else "gt"}': value})
+        if condition is not None:
+            after |= Q(**{name: value}) & condition
+        condition = after
+    first = ordering[0]
+    return Q(**{
+        f'{first.lstrip("-")}__{"lte" if first[0] == "-" else "gte"}':
+            position[0]
+    }) & condition
+
+
+def reverse_ordering(ordering):
+    return tuple(
+        field[1:] if field[0] == '-' else f'-{field}' for field in ordering
+    )
+
+
+class CursorLimitPagination(CursorPagination):
+    # Unlike the stock CursorPagination, which keys the cursor on the first
+    # ordering field and skips ties with an offset, the cursor holds the
+    # values of every ordering field, so any page is a single index seek.
+    page_size = 6
+    page_size_query_param = 'limit'
+    count_cache_timeout = 60
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.count = self.get_count(queryset)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        position = self.decode_position(self.cursor)
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = (
+            reverse_ordering(self.ordering) if reverse else self.ordering
+        )
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(ordering, position))
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def decode_position(self, cursor):
+        if cursor is None or cursor.position is None:
+            return None
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(
+            self.ordering
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_position(self, instance, reverse):
+        return self.encode_cursor(Cursor(
+            offset=0,
+            reverse=reverse,
+            position=json.dumps([
+                getattr(instance, field.lstrip('-'))
+                for field in self.ordering
+            ])
+        ))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_position(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_position(self.page[0], reverse=True)
+
+    def get_count(self, queryset):
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'pagination-count:' + md5(
+            f'{sql}{params}'.encode()
+        ).hexdigest()
+        return cache.get_or_set(
+            key, queryset.count, self.count_cache_timeout
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class RecipeCursorPagination(CursorLimitPagination):
+    ordering = ('name', 'id')
+
+
+class UserCursorPagination(CursorLimitPagination):
+    ordering = ('username',)
@@ -0,0 +1,120 @@
+import json
+import logging
+import re
+from collections import Counter
+from random import random
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+MAX_REPORTED_FINGERPRINTS = 5
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def fingerprint(sql):
+    # Queries that differ only in parameters, literals or the length of an
+    # IN list share a fingerprint, so N+1 queries show up as duplicates.
+    sql = LITERALS.sub('?', sql).replace('%s', '?')
+    sql = PLACEHOLDER_LISTS.sub('(...)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def duplicate_fingerprints(queries):
+    counts = Counter(fingerprint(sql) for sql in queries)
+    return [
+        {'fingerprint': sql, 'count': count}
+        for sql, count in counts.most_common(MAX_REPORTED_FINGERPRINTS)
+        if count > 1
+    ]
+
+
+def resolve_budget(view, method):
+    budget = getattr(view, 'query_budget', None)
+    view_class = getattr(view, 'cls', None)
+    if view_class is None:
+        return budget, getattr(view, '__qualname__', repr(view))
+    actions = getattr(view, 'actions', None)
+    name = actions.get(method) if actions else method
+    if name is None:
+        return budget, view_class.__name__
+    handler = getattr(view_class, name, None)
+    budget = getattr(
+        handler,
+        'query_budget',
+        getattr(view_class, 'query_budgets', {}).get(name, budget)
+    )
+    return budget, f'{view_class.__name__}.{name}'
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        enforce = settings.QUERY_BUDGET_ENFORCE
+        if not enforce and random() >= settings.QUERY_BUDGET_SAMPLE_RATE:
+            return self.get_response(request)
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = self.get_response(request)
+        if response.streaming and not response.is_async:
+            # Streamed bodies query the database while they are consumed,
+            # so the budget is checked once the last chunk is sent.
+            response.streaming_content = self.stream(
+                request, response.streaming_content, record, queries, enforce
+            )
+        else:
+            self.check_budget(request, queries, enforce)
+        return response
+
+    def stream(self, request, content, record, queries, enforce):
+        with connection.execute_wrapper(record):
+            yield from content
+        self.check_budget(request, queries, enforce)
+
+    def check_budget(self, request, queries, enforce):
+        budget, view = getattr(request, 'query_budget', (None, None))
+        if budget is None or len(queries) <= budget:
+            return
+        report = {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'budget': budget,
+            'queries': len(queries),
+            'duplicates': duplicate_fingerprints(queries),
+        }
+        if enforce:
+            raise QueryBudgetExceeded(
+                json.dumps(report, ensure_ascii=False, indent=2)
+            )
+        logger.warning(
+            'Query budget exceeded: %s',
+            json.dumps(report, ensure_ascii=False),
+            extra={'query_budget': report}
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = resolve_budget(
+            view_func, request.method.lower()
+        )
@@ -1,46 +1,168 @@
 from rest_framework import serializers
+from django.db import transaction
 from django.contrib.auth import get_user_model
-from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 
-from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.images import (AVATAR_SIZES, RECIPE_IMAGE_SIZES,
+                            image_variants, store_image)
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingListItem)
+from recipes.pantry_index import mark_recipes_changed
+from recipes.tasks import render_image_variants
+from .cache import (get_recipe_payloads, invalidate_recipe_payloads,
+                    set_recipe_payloads)
+from .uploads import base64_image_file
 
 
 User = get_user_model()
 
+BULK_ACTION_MAX_ITEMS = 500
+PANTRY_MAX_INGREDIENTS = 200
+PANTRY_MAX_MISSING = 5
 
-class StrictBase64ImageField(Base64ImageField):
+
+class StrictBase64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if data == '':
             raise serializers.ValidationError('This field is required.')
-        return super().to_internal_value(data)
+        if data in (None, [], (), {}):
+            return None
+        if not isinstance(data, str):
+            raise serializers.ValidationError(
+                'Изображение должно быть строкой Base64.'
+            )
+        return base64_image_file(data)
+
+
+class ProcessedBase64ImageField(StrictBase64ImageField):
+    def __init__(self, *args, sizes, **kwargs):
+        self.sizes = sizes
+        super().__init__(*args, **kwargs)
+
+    def store(self, file):
+        upload_to = self.parent.Meta.model._meta.get_field(
+            self.source
+        ).upload_to
+        try:
+            return store_image(file, upload_to, self.sizes)
+        except (OSError, SyntaxError, Image.DecompressionBombError):
+            raise serializers.ValidationError(
+                {self.field_name: ['Загрузите корректное изображение.']}
+            )
+        finally:
+            file.close()
+
+
+def processed_image_fields(serializer, validated_data):
+    for field in serializer._writable_fields:
+        if (
+            isinstance(field, ProcessedBase64ImageField)
+            and validated_data.get(field.source)
+        ):
+            yield field
+
+
+def store_images(serializer, validated_data):
+    # Validation only decodes the upload. The image is written from create
+    # and update, so a request that fails validation leaves no file behind.
+    for field in processed_image_fields(serializer, validated_data):
+        validated_data[field.source] = field.store(
+            validated_data[field.source]
+        )
+
+
+def enqueue_image_variants(serializer, validated_data):
+    # Called from create and update inside their transaction, so a request
+    # that fails after validation leaves no task behind.
+    for field in processed_image_fields(serializer, validated_data):
+        render_image_variants.enqueue(
+            name=validated_data[field.source], sizes=field.sizes
+        )
+
+
+def build_variant_urls(variants, build_url):
+    return {
+        label: {
+            image_format: build_url(url)
+            for image_format, url in formats.items()
+        }
+        for label, formats in variants.items()
+    }
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    def __init__(self, *args, sizes, **kwargs):
+        self.sizes = sizes
+        super().__init__(*args, **kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        request = self.context.get('request')
+        return build_variant_urls(
+            image_variants(value.name, self.sizes, value.storage),
+            lambda name: request.build_absolute_uri(value.storage.url(name))
+            if request is not None else value.storage.url(name)
+        )
 
 
 class ShortRecipesSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField(
+        source='image',
+        sizes=RECIPE_IMAGE_SIZES
+    )
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
         read_only_fields = fields
 
 
+def get_subscribed_ids(request):
+    if not hasattr(request, 'subscribed_ids'):
+        user = request.user
+        request.subscribed_ids = set(
+            user.subscriptions.values_list('subscribe_id', flat=True)
+        ) if user.is_authenticated else set()
+    return request.subscribed_ids
+
+
 class UserSerializer(DjoserUserSerializer):
-    avatar = StrictBase64ImageField()
+    avatar = ProcessedBase64ImageField(sizes=AVATAR_SIZES)
+    avatar_variants = ImageVariantsField(source='avatar', sizes=AVATAR_SIZES)
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     class Meta(DjoserUserSerializer.Meta):
         fields = DjoserUserSerializer.Meta.fields + (
             'is_subscribed',
-            'avatar'
+            'avatar',
+            'avatar_variants'
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return user.is_authenticated and user.subscriptions.filter(id=obj.id).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.pk in get_subscribed_ids(self.context.get('request'))
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        store_images(self, validated_data)
+        instance = super().update(instance, validated_data)
+        enqueue_image_variants(self, validated_data)
+        return instance
+
+
+def get_recipes_limit(request):
+    limit = request.query_params.get('recipes_limit')
+    if limit and limit.isdigit():
+        return int(limit)
+    return None
 
 
 class SubscriptionsUserSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(source='recipes.count', read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -49,12 +171,13 @@ class SubscriptionsUserSerializer(UserSerializer):
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit')
-
-        recipes = obj.recipes.all()
 
-        if limit and limit.isdigit() and int(limit) >= 0:
-            recipes = recipes[:int(limit)]
+        recipes = getattr(obj, 'preview_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(request)
+            if limit is not None:
+                recipes = recipes[:limit]
 
         serializers = ShortRecipesSerializer(
             recipes,
@@ -65,6 +188,44 @@ class SubscriptionsUserSerializer(UserSerializer):
         return serializers.data
 
 
+class BulkActionSerializer(serializers.Serializer):
+    add = serializers.ListField(
+        child=serializers.IntegerField(),
+        max_length=BULK_ACTION_MAX_ITEMS,
+        required=False,
+        default=list
+    )
+    remove = serializers.ListField(
+        child=serializers.IntegerField(),
+        max_length=BULK_ACTION_MAX_ITEMS,
+        required=False,
+        default=list
+    )
+
+    def validate(self, attrs):
+        attrs['add'] = list(dict.fromkeys(attrs['add']))
+        attrs['remove'] = list(dict.fromkeys(attrs['remove']))
+        if set(attrs['add']) & set(attrs['remove']):
+            raise serializers.ValidationError(
+                'Один и тот же id нельзя одновременно добавить и удалить.'
+            )
+        return attrs
+
+
+class PantrySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=PANTRY_MAX_INGREDIENTS
+    )
+    missing = serializers.IntegerField(
+        min_value=0,
+        max_value=PANTRY_MAX_MISSING,
+        required=False,
+        default=0
+    )
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
@@ -83,9 +244,7 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(
         min_value=1,
     )
@@ -95,16 +254,71 @@ class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
         fields = ['id', 'amount']
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
-    author = UserSerializer()
+class RecipeAuthorPayloadSerializer(DjoserUserSerializer):
+    avatar = serializers.ImageField(read_only=True)
+    avatar_variants = ImageVariantsField(source='avatar', sizes=AVATAR_SIZES)
+
+    class Meta(DjoserUserSerializer.Meta):
+        fields = DjoserUserSerializer.Meta.fields + (
+            'avatar', 'avatar_variants'
+        )
+
+
+class RecipePayloadSerializer(serializers.ModelSerializer):
+    author = RecipeAuthorPayloadSerializer()
     ingredients = RecipeIngredientReadSerializer(
+        source='recipe_ingredients',
         many=True,
     )
+    image = serializers.ImageField(read_only=True)
+    image_variants = ImageVariantsField(
+        source='image',
+        sizes=RECIPE_IMAGE_SIZES
+    )
 
     class Meta:
         model = Recipe
+        fields = (
+            'id',
+            'author',
+            'ingredients',
+            'name',
+            'image',
+            'image_variants',
+            'text',
+            'cooking_time'
+        )
+        read_only_fields = fields
+
+
+def load_recipe_payloads(recipes):
+    recipe_ids = [recipe.pk for recipe in recipes]
+    payloads = get_recipe_payloads(recipe_ids)
+    missing = [pk for pk in recipe_ids if pk not in payloads]
+    if missing:
+        fresh = {
+            item['id']: item for item in RecipePayloadSerializer(
+                Recipe.objects.filter(pk__in=missing).with_payload_data(),
+                many=True
+            ).data
+        }
+        set_recipe_payloads(fresh)
+        payloads.update(fresh)
+    return payloads
+
+
+class RecipeReadListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        recipes = list(data)
+        self.child.payloads = load_recipe_payloads(recipes)
+        return super().to_representation(recipes)
+
+
+class RecipeReadSerializer(serializers.BaseSerializer):
+    payloads = None
+
+    class Meta:
+        list_serializer_class = RecipeReadListSerializer
         fields = [
             'id',
             'author',
@@ -113,23 +327,58 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time'
         ]
-        read_only_fields = fields
 
-    def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        return request.user.is_authenticated and obj.favorites.filter(user=request.user).exists()
+    def build_url(self, url):
+        if url is None:
+            return None
+        return self.context.get('request').build_absolute_uri(url)
 
-    def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        return request.user.is_authenticated and obj.shopping_carts.filter(user=request.user).exists()
+    def to_representation(self, instance):
+        if self.payloads is None:
+            self.payloads = load_recipe_payloads([instance])
+        payload = self.payloads[instance.pk]
+        author = payload['author']
+        viewer_data = {
+            'author': {
+                field: author.get(field)
+                for field in UserSerializer.Meta.fields
+            } | {
+                'is_subscribed': instance.is_author_subscribed,
+                'avatar': self.build_url(author['avatar']),
+                'avatar_variants': author['avatar_variants'] and (
+                    build_variant_urls(
+                        author['avatar_variants'], self.build_url
+                    )
+                ),
+            },
+            'is_favorited': instance.is_favorited,
+            'is_in_shopping_cart': instance.is_in_shopping_cart,
+            'image': self.build_url(payload['image']),
+            'image_variants': build_variant_urls(
+                payload['image_variants'], self.build_url
+            ),
+        }
+        return {
+            field: viewer_data[field] if field in viewer_data
+            else payload[field]
+            for field in self.Meta.fields
+        }
+
+
+class PantryRecipeSerializer(RecipeReadSerializer):
+    def to_representation(self, instance):
+        return super().to_representation(instance) | {
+            'missing_count': instance.missing_count
+        }
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientWriteSerializer(many=True)
-    image = StrictBase64ImageField()
+    image = ProcessedBase64ImageField(sizes=RECIPE_IMAGE_SIZES)
     cooking_time = serializers.IntegerField(
         min_value=1,
     )
@@ -154,27 +403,106 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 'Ingredient is repeat.'
             )
 
+        existing = Ingredient.objects.in_bulk(ingredients)
+        missing = [pk for pk in ingredients if pk not in existing]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {", ".join(map(str, missing))}.'
+            )
+
+        for item in value:
+            item['ingredient'] = existing[item['id']]
         return value
 
     def add_recipe_ingredients(self, instance, ingredients):
         RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
                 recipe=instance,
-                ingredient=item['id'],
+                ingredient=item['ingredient'],
                 amount=item['amount']
             ) for item in ingredients)
+        invalidate_recipe_payloads([instance.pk])
+        mark_recipes_changed([instance.pk])
+
+    def update_recipe_ingredients(self, instance, ingredients):
+        existing = {
+            item.ingredient_id: item
+            for item in instance.recipe_ingredients.all()
+        }
+        amounts = {
+            item['ingredient'].id: item['amount'] for item in ingredients
+        }
+        # Deleted rows are subtracted from shopping lists by the delete
+        # signals, bulk updates and inserts send none.
+        deltas = {
+            ingredient_id: amount - (
+                existing[ingredient_id].amount
+                if ingredient_id in existing else 0
+            )
+            for ingredient_id, amount in amounts.items()
+        }
+
+        to_delete = [
+            item.pk for ingredient_id, item in existing.items()
+            if ingredient_id not in amounts
+        ]
+        to_update = []
+        for ingredient_id, amount in amounts.items():
+            item = existing.get(ingredient_id)
+            if item is not None and item.amount != amount:
+                item.amount = amount
+                to_update.append(item)
+        to_create = [
+            item for item in ingredients
+            if item['ingredient'].id not in existing
+        ]
+
+        if to_delete:
+            RecipeIngredient.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            self.add_recipe_ingredients(instance, to_create)
+        elif to_update:
+            invalidate_recipe_payloads([instance.pk])
+        if to_update or to_create:
+            ShoppingListItem.objects.apply_deltas(
+                instance.shopping_carts.values_list('user_id', flat=True),
+                deltas
+            )
 
+    def validate(self, attrs):
+        if 'ingredients' not in attrs:
+            raise serializers.ValidationError(
+                {'ingredients': 'Обязательное поле.'}
+            )
+        return attrs
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
+        store_images(self, validated_data)
         recipe = super().create(validated_data)
         self.add_recipe_ingredients(recipe, ingredients_data)
+        enqueue_image_variants(self, validated_data)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('ingredients', None)
-        instance.recipe_ingredients.all().delete()
-        self.add_recipe_ingredients(instance, ingredients_data)
-        return super().update(instance, validated_data)
+        # The diff is computed from the stored rows, so concurrent updates
+        # of one recipe wait for each other instead of inserting the same
+        # ingredient twice.
+        list(Recipe.objects.select_for_update().filter(
+            pk=instance.pk
+        ).values_list('pk'))
+        ingredients_data = validated_data.pop('ingredients')
+        self.update_recipe_ingredients(instance, ingredients_data)
+        store_images(self, validated_data)
+        instance = super().update(instance, validated_data)
+        enqueue_image_variants(self, validated_data)
+        return instance
 
     def to_representation(self, instance):
+        user = self.context.get('request').user
+        instance = Recipe.objects.with_user_flags(user).get(pk=instance.pk)
         return RecipeReadSerializer(instance, context=self.context).data
@@ -0,0 +1,149 @@
+import csv
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.negotiation import DefaultContentNegotiation
+
+ITERATOR_CHUNK_SIZE = 2000
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+PDF_SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class ShoppingListContentNegotiation(DefaultContentNegotiation):
+    # ?format= selects the file type here, not the DRF renderer.
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return super().select_renderer(request, renderers, 'json')
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def get_ingredients(user):
+    return user.shopping_list_items.values(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'total_amount'
+    ).order_by('ingredient__name').iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+
+def get_recipes(user):
+    return user.shopping_carts.values_list(
+        'recipe__name',
+        'recipe__author__username'
+    ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+
+def shopping_list_lines(user):
+    current_date = datetime.now().strftime('%d.%m.%Y')
+    yield f'Список покупок на {current_date}'
+    yield f'Пользователь: {user.username}'
+    yield ''
+    yield 'Продукты к покупке:'
+    for i, item in enumerate(get_ingredients(user), start=1):
+        yield (
+            f'{i}. {item["ingredient__name"].capitalize()} - '
+            f'{item["total_amount"]} {item["ingredient__measurement_unit"]}'
+        )
+    yield ''
+    yield 'Продукты для рецептов:'
+    for name, author in get_recipes(user):
+        yield f'- {name} (автор: {author})'
+
+
+def render_txt(user):
+    lines = shopping_list_lines(user)
+    yield next(lines)
+    for line in lines:
+        yield f'\n{line}'
+
+
+def render_csv(user):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Продукт', 'Количество', 'Единица измерения'))
+    for item in get_ingredients(user):
+        yield writer.writerow((
+            item['ingredient__name'].capitalize(),
+            item['total_amount'],
+            item['ingredient__measurement_unit']
+        ))
+
+
+def get_pdf_font():
+    if PDF_FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return PDF_FONT_NAME
+    if not os.path.exists(settings.SHOPPING_LIST_PDF_FONT):
+        return 'Helvetica'
+    pdfmetrics.registerFont(
+        TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT)
+    )
+    return PDF_FONT_NAME
+
+
+def wrap_pdf_line(line, font, max_width):
+    # simpleSplit breaks lines at spaces only, so a word wider than the page
+    # is cut between characters.
+    lines = []
+    for part in simpleSplit(line, font, PDF_FONT_SIZE, max_width) or ['']:
+        while pdfmetrics.stringWidth(part, font, PDF_FONT_SIZE) > max_width:
+            cut = len(part) - 1
+            while cut > 1 and pdfmetrics.stringWidth(
+                part[:cut], font, PDF_FONT_SIZE
+            ) > max_width:
+                cut -= 1
+            lines.append(part[:cut])
+            part = part[cut:]
+        lines.append(part)
+    return lines
+
+
+@contextmanager
+def render_pdf(user):
+    with SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_SIZE) as output:
+        font = get_pdf_font()
+        width, height = A4
+        pdf = canvas.Canvas(output, pagesize=A4)
+        pdf.setFont(font, PDF_FONT_SIZE)
+        y = height - PDF_MARGIN
+        for line in shopping_list_lines(user):
+            for part in wrap_pdf_line(line, font, width - 2 * PDF_MARGIN):
+                if y < PDF_MARGIN:
+                    pdf.showPage()
+                    pdf.setFont(font, PDF_FONT_SIZE)
+                    y = height - PDF_MARGIN
+                pdf.drawString(PDF_MARGIN, y, part)
+                y -= PDF_FONT_SIZE * 1.5
+        pdf.save()
+        output.seek(0)
+        yield output
+
+
+RENDERERS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+}
+# Rendered by the worker, see recipes.tasks.render_shopping_list_pdf.
+EXPORT_FORMATS = ('pdf',)
+
+
+def shopping_list_response(user, file_format):
+    render, content_type = RENDERERS[file_format]
+    filename = f'shopping_list.{file_format}'
+    response = StreamingHttpResponse(render(user), content_type=content_type)
+    response['Content-Disposition'] = content_disposition_header(
+        True, filename
+    )
+    return response
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipes.ingredient_index import bump_index_version
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.pantry_index import mark_recipes_changed
+
+from .cache import invalidate_recipe_payloads
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    invalidate_recipe_payloads([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def invalidate_recipe_ingredient(sender, instance, **kwargs):
+    invalidate_recipe_payloads([instance.recipe_id])
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_pantry_recipe(sender, instance, **kwargs):
+    mark_recipes_changed([instance.pk])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def invalidate_pantry_recipe_ingredient(sender, instance, created, **kwargs):
+    if created:
+        mark_recipes_changed([instance.recipe_id])
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def invalidate_pantry_deleted_recipe_ingredient(sender, instance, **kwargs):
+    mark_recipes_changed([instance.recipe_id])
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient(sender, instance, **kwargs):
+    invalidate_recipe_payloads(
+        RecipeIngredient.objects.filter(
+            ingredient=instance
+        ).values_list('recipe_id', flat=True)
+    )
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    bump_index_version()
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, created, update_fields=None,
+                      **kwargs):
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    invalidate_recipe_payloads(
+        instance.recipes.values_list('id', flat=True)
+    )
@@ -0,0 +1,1050 @@
+import os
+import re
+import shutil
+import tempfile
+from base64 import b64decode, b64encode
+from datetime import datetime, timedelta
+from io import BytesIO
+from pathlib import Path
+from threading import Barrier, Thread
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from recipes.images import (
+    RECIPE_IMAGE_SIZES,
+    ready_names,
+    save_once,
+    variant_url,
+)
+from recipes.models import (
+    DeletedFile,
+    FavoriteRecipes,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListExport,
+    ShoppingListItem,
+)
+from recipes.tasks import purge_shopping_list_exports
+from reportlab.pdfbase import pdfmetrics
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from tasks.models import Task
+from tasks.worker import run_pending_tasks
+from users.models import Subscriptions
+
+from .cache import get_recipe_payloads
+from .filters import RecipeFilter
+from .query_budget import QueryBudgetExceeded
+from .shopping_list import (
+    PDF_FONT_SIZE,
+    get_pdf_font,
+    render_pdf,
+    wrap_pdf_line,
+)
+from .uploads import base64_image_file
+from .views import RecipeViewSet
+
+User = get_user_model()
+
+
+def create_user(username):
+    return User.objects.create_user(
+        email=f'{username}@example.com',
+        username=username,
+        password='password',
+        first_name=username,
+        last_name=username
+    )
+
+
+def create_recipe(author, name, ingredients=()):
+    recipe = Recipe.objects.create(
+        author=author,
+        name=name,
+        text=f'{name} text',
+        cooking_time=10,
+        image='recipes/test.jpg'
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=amount)
+        for ingredient, amount in ingredients
+    )
+    return recipe
+
+
+def base64_image(color='red'):
+    output = BytesIO()
+    Image.new('RGB', (40, 30), color).save(output, 'PNG')
+    return 'data:image/png;base64,' + b64encode(output.getvalue()).decode()
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.salt = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        self.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+
+
+class RecipeCursorPaginationTests(APITestCase):
+    def test_pages_cover_duplicate_names_without_offsets(self):
+        recipes = [
+            create_recipe(self.user, name)
+            for name in ['Суп'] * 7 + ['Борщ'] * 3 + ['Щи'] * 2
+        ]
+        ids, url, pages = [], '/api/recipes/?pagination=cursor&limit=5', []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+            self.assertFalse(any(
+                'OFFSET' in query['sql'] for query in queries
+            ))
+        expected = sorted(recipes, key=lambda recipe: (recipe.name, recipe.pk))
+        self.assertEqual(ids, [recipe.pk for recipe in expected])
+        self.assertEqual(pages[0]['count'], len(recipes))
+
+        previous = self.client.get(pages[-1]['previous']).data
+        self.assertEqual(
+            [recipe['id'] for recipe in previous['results']],
+            [recipe['id'] for recipe in pages[-2]['results']]
+        )
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_search_keeps_page_numbers(self):
+        for name in ('Суп', 'Суп грибной', 'Суп рыбный'):
+            create_recipe(self.user, name)
+        response = self.client.get(
+            '/api/recipes/?pagination=cursor&limit=2&search=Суп'
+        )
+        self.assertEqual(response.data['count'], 3)
+        self.assertIn('page=2', response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            '/api/recipes/?pagination=cursor&cursor=cD1ub3Rqc29u'
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class BulkActionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_user('author')
+        self.recipes = [
+            create_recipe(self.author, name, [(self.salt, 5)])
+            for name in ('Суп', 'Каша', 'Щи')
+        ]
+
+    def test_bulk_and_single_changes_count_rows_once(self):
+        first, second, third = self.recipes
+        self.client.post(f'/api/recipes/{first.pk}/favorite/')
+        response = self.client.post('/api/recipes/favorite/bulk/', {
+            'add': [first.pk, second.pk, 0],
+        }, format='json')
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['exists', 'added', 'not_found']
+        )
+        self.client.post('/api/recipes/favorite/bulk/', {
+            'add': [third.pk], 'remove': [first.pk, first.pk],
+        }, format='json')
+        for recipe in Recipe.objects.all():
+            self.assertEqual(
+                recipe.favorites_count,
+                FavoriteRecipes.objects.filter(recipe=recipe).count()
+            )
+
+    def test_bulk_shopping_cart_updates_counters_and_list(self):
+        self.client.post('/api/recipes/shopping_cart/bulk/', {
+            'add': [recipe.pk for recipe in self.recipes],
+        }, format='json')
+        self.client.post('/api/recipes/shopping_cart/bulk/', {
+            'remove': [self.recipes[0].pk],
+        }, format='json')
+        self.assertEqual(
+            list(Recipe.objects.order_by('pk').values_list(
+                'shopping_carts_count', flat=True
+            )),
+            [0, 1, 1]
+        )
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.user).total_amount, 10
+        )
+
+    def test_bulk_subscribe_counters(self):
+        other = create_user('other')
+        self.client.post(f'/api/users/{other.pk}/subscribe/')
+        self.client.post('/api/users/subscribe/bulk/', {
+            'add': [other.pk, self.author.pk, self.user.pk],
+        }, format='json')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.subscriptions_count, 2)
+        self.assertEqual(
+            Subscriptions.objects.filter(user=self.user).count(), 2
+        )
+        self.assertEqual(
+            list(User.objects.filter(
+                pk__in=[other.pk, self.author.pk]
+            ).values_list('subscribers_count', flat=True)),
+            [1, 1]
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs row locks')
+class ConcurrentBulkActionTests(TransactionTestCase):
+    def test_overlapping_requests_count_rows_once(self):
+        user = create_user('user')
+        ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        recipe_ids = [
+            create_recipe(user, f'Рецепт {number}', [(ingredient, 1)]).pk
+            for number in range(20)
+        ]
+        barrier = Barrier(4)
+
+        def add(path):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                client.post(path, {'add': recipe_ids}, format='json')
+            finally:
+                connection.close()
+
+        threads = [
+            Thread(target=add, args=(path,))
+            for path in ['/api/recipes/shopping_cart/bulk/'] * 2
+            + [f'/api/recipes/{recipe_ids[0]}/shopping_cart/'] * 2
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(ShoppingCart.objects.count(), len(recipe_ids))
+        self.assertEqual(
+            set(Recipe.objects.values_list('shopping_carts_count', flat=True)),
+            {1}
+        )
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=user).total_amount,
+            len(recipe_ids)
+        )
+
+
+    def test_overlapping_recipe_updates_add_each_ingredient_once(self):
+        user = create_user('user')
+        salt, sugar = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'сахар')
+        )
+        recipe = create_recipe(user, 'Суп', [(salt, 1)])
+        barrier = Barrier(2)
+        statuses = []
+
+        def update(amount):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                statuses.append(client.patch(
+                    f'/api/recipes/{recipe.pk}/',
+                    {'ingredients': [
+                        {'id': salt.pk, 'amount': 1},
+                        {'id': sugar.pk, 'amount': amount},
+                    ]},
+                    format='json'
+                ).status_code)
+            finally:
+                connection.close()
+
+        threads = [Thread(target=update, args=(amount,)) for amount in (2, 3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(
+            recipe.recipe_ingredients.filter(ingredient=sugar).count(), 1
+        )
+
+
+class RecipeFilterTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.authors = [create_user('author1'), create_user('author2')]
+        self.soup = create_recipe(
+            self.authors[0], 'Суп', [(self.salt, 5), (self.flour, 10)]
+        )
+        self.bread = create_recipe(
+            self.authors[1], 'Хлеб', [(self.flour, 500)]
+        )
+        self.porridge = create_recipe(self.user, 'Каша', [(self.salt, 1)])
+        for recipe in (self.soup, self.bread):
+            FavoriteRecipes.objects.create(user=self.user, recipe=recipe)
+            FavoriteRecipes.objects.create(
+                user=self.authors[0], recipe=recipe
+            )
+        ShoppingCart.objects.create(user=self.user, recipe=self.soup)
+        ShoppingCart.objects.create(user=self.authors[1], recipe=self.soup)
+
+    def ids(self, query, client=None):
+        response = (client or self.client).get(
+            f'/api/recipes/?limit=100&{query}'
+        )
+        self.assertEqual(response.status_code, 200)
+        ids = [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(len(ids), len(set(ids)))
+        return set(ids)
+
+    def test_user_relation_filters(self):
+        self.assertEqual(
+            self.ids('is_favorited=1'), {self.soup.pk, self.bread.pk}
+        )
+        self.assertEqual(self.ids('is_favorited=0'), {self.porridge.pk})
+        self.assertEqual(self.ids('is_in_shopping_cart=1'), {self.soup.pk})
+        self.assertEqual(
+            self.ids('is_favorited=1&is_in_shopping_cart=0'),
+            {self.bread.pk}
+        )
+        self.assertEqual(len(self.ids('is_favorited=1', APIClient())), 3)
+
+    def test_several_authors(self):
+        first, second = (author.pk for author in self.authors)
+        expected = {self.soup.pk, self.bread.pk}
+        self.assertEqual(self.ids(f'author={first},{second}'), expected)
+        self.assertEqual(
+            self.ids(f'author={first}&author={second}'), expected
+        )
+        self.assertEqual(self.ids(f'author={second}'), {self.bread.pk})
+
+    def test_all_ingredients_must_match(self):
+        self.assertEqual(
+            self.ids(f'ingredients={self.flour.pk}'),
+            {self.soup.pk, self.bread.pk}
+        )
+        self.assertEqual(
+            self.ids(f'ingredients={self.flour.pk},{self.salt.pk}'),
+            {self.soup.pk}
+        )
+        self.assertEqual(
+            self.ids(f'ingredients={self.salt.pk}&is_favorited=0'),
+            {self.porridge.pk}
+        )
+
+    def test_relation_filters_use_exists(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.ids('is_favorited=1&is_in_shopping_cart=1')
+        sql = next(
+            query['sql'] for query in queries
+            if 'recipes_recipe' in query['sql'] and 'LIMIT' in query['sql']
+        )
+        self.assertIn('EXISTS', sql)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('JOIN "recipes_favoriterecipes"', sql)
+        self.assertNotIn('JOIN "recipes_shoppingcart"', sql)
+
+    def relation_filter_plan(self):
+        queryset = RecipeFilter(
+            QueryDict('is_favorited=1&is_in_shopping_cart=1'),
+            queryset=Recipe.objects.all(),
+            request=SimpleNamespace(user=self.user)
+        ).qs
+        if connection.vendor == 'postgresql':
+            # The test tables are tiny, so the planner would rather read
+            # them whole; this only asks whether an index can be used.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_relation_filters_use_the_unique_indexes(self):
+        plan = self.relation_filter_plan()
+        for table, index in (
+            ('recipes_favoriterecipes', 'unique_user_recipe_favorites'),
+            ('recipes_shoppingcart', 'unique_user_recipe_shopping_cart'),
+        ):
+            if connection.vendor == 'postgresql':
+                self.assertIn(index, plan)
+                self.assertNotIn(f'Seq Scan on {table}', plan)
+            else:
+                # SQLite names the index of a UNIQUE table constraint
+                # sqlite_autoindex_<table>_N.
+                self.assertRegex(
+                    plan,
+                    rf'SEARCH \w+ USING (COVERING )?INDEX '
+                    rf'sqlite_autoindex_{table}_'
+                )
+
+    @skipUnless(connection.vendor == 'postgresql', 'Postgres plan')
+    def test_relation_filter_plan_does_not_deduplicate(self):
+        plan = self.relation_filter_plan()
+        # A join would multiply recipe rows and need a Unique or aggregate
+        # node on top to remove them again.
+        top = plan.splitlines()[0]
+        self.assertFalse(top.startswith(('Unique', 'HashAggregate')), plan)
+        self.assertNotIn('Group Key: recipes_recipe.id', plan)
+
+
+def encoded_image(image, image_format, mime='image/png'):
+    output = BytesIO()
+    image.save(output, image_format)
+    return f'data:{mime};base64,' + b64encode(output.getvalue()).decode()
+
+
+class UploadDecoderTests(TestCase):
+    def decode(self, data):
+        file = base64_image_file(data)
+        self.addCleanup(file.close)
+        return file
+
+    def assertRejected(self, data, message):
+        with self.assertRaisesMessage(ValidationError, message):
+            self.decode(data)
+
+    def test_invalid_base64_is_rejected(self):
+        self.assertRejected(
+            'data:image/png;base64,!!!!', 'Загрузите корректное изображение.'
+        )
+        self.assertRejected(
+            base64_image()[:-1], 'Загрузите корректное изображение.'
+        )
+        self.assertRejected(
+            'data:image/png;base64,' + b64encode(b'not an image').decode(),
+            'Загрузите корректное изображение.'
+        )
+
+    def test_format_comes_from_the_content(self):
+        image = Image.new('RGB', (40, 30))
+        file = self.decode(encoded_image(image, 'JPEG', mime='image/png'))
+        self.assertTrue(file.name.endswith('.jpg'))
+        with Image.open(file) as decoded:
+            self.assertEqual(decoded.format, 'JPEG')
+        self.assertRejected(
+            encoded_image(image, 'BMP'), 'Допустимые форматы'
+        )
+
+    def test_whitespace_in_the_payload_is_ignored(self):
+        data = base64_image()
+        header, payload = data.split(',')
+        wrapped = '\n'.join(
+            payload[position:position + 76]
+            for position in range(0, len(payload), 76)
+        )
+        file = self.decode(f'{header},{wrapped}')
+        self.assertEqual(file.read(), b64decode(payload))
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_size_limit(self):
+        # Checked from the payload length before anything is decoded.
+        self.assertRejected(
+            'data:image/png;base64,' + 'A' * 200, 'превышает 100 байт'
+        )
+
+    @override_settings(
+        IMAGE_UPLOAD_MAX_PIXELS=2000, IMAGE_UPLOAD_MAX_FULL_DECODE_PIXELS=1000
+    )
+    def test_pixel_limits_depend_on_the_format(self):
+        image = Image.new('RGB', (40, 30))
+        self.decode(encoded_image(image, 'JPEG'))
+        self.assertRejected(
+            encoded_image(image, 'PNG'), 'больше 1000 пикселей'
+        )
+        self.assertRejected(
+            encoded_image(Image.new('RGB', (50, 50)), 'JPEG'),
+            'больше 2000 пикселей'
+        )
+
+    def test_large_uploads_are_spooled_to_disk(self):
+        self.assertFalse(self.decode(base64_image()).file._rolled)
+        noise = Image.frombytes('RGB', (700, 700), os.urandom(700 * 700 * 3))
+        file = self.decode(encoded_image(noise, 'PNG'))
+        self.assertTrue(file.file._rolled)
+        with Image.open(file) as decoded:
+            self.assertEqual(decoded.size, (700, 700))
+
+
+class RecipeIngredientsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.recipe = create_recipe(
+            self.user, 'Суп', [(self.salt, 5), (self.flour, 10)]
+        )
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def patch(self, ingredients):
+        return self.client.patch(
+            self.url,
+            {'ingredients': [
+                {'id': ingredient.pk, 'amount': amount}
+                for ingredient, amount in ingredients
+            ]},
+            format='json'
+        )
+
+    def test_missing_ingredients_are_listed(self):
+        response = self.client.patch(self.url, {'ingredients': [
+            {'id': self.salt.pk, 'amount': 1},
+            {'id': 999998, 'amount': 1},
+            {'id': 999999, 'amount': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['ingredients'],
+            ['Ингредиенты не найдены: 999998, 999999.']
+        )
+        self.assertEqual(self.recipe.recipe_ingredients.count(), 2)
+
+    def test_duplicates_are_rejected(self):
+        response = self.patch([(self.salt, 1), (self.salt, 2)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.data)
+
+    def test_only_changed_rows_are_written(self):
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        other = create_user('other')
+        ShoppingCart.objects.create(user=other, recipe=self.recipe)
+        rows = dict(self.recipe.recipe_ingredients.values_list(
+            'ingredient_id', 'pk'
+        ))
+
+        response = self.patch([(self.salt, 5), (self.flour, 20), (sugar, 3)])
+        self.assertEqual(response.status_code, 200)
+        stored = {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount in
+            self.recipe.recipe_ingredients.values_list(
+                'pk', 'ingredient_id', 'amount'
+            )
+        }
+        self.assertEqual(stored[self.salt.pk], (rows[self.salt.pk], 5))
+        self.assertEqual(stored[self.flour.pk], (rows[self.flour.pk], 20))
+        self.assertEqual(stored[sugar.pk][1], 3)
+
+        self.patch([(self.salt, 5)])
+        self.assertEqual(
+            list(self.recipe.recipe_ingredients.values_list('pk', 'amount')),
+            [(rows[self.salt.pk], 5)]
+        )
+        self.assertEqual(
+            list(ShoppingListItem.objects.filter(user=other).values_list(
+                'ingredient_id', 'total_amount'
+            )),
+            [(self.salt.pk, 5)]
+        )
+
+    def test_query_count_does_not_grow_with_ingredients(self):
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'специя {number}', measurement_unit='г'
+            )
+            for number in range(12)
+        ]
+        counts = []
+        for size in (2, 12):
+            self.patch([(ingredient, 1) for ingredient in ingredients[:size]])
+            with CaptureQueriesContext(connection) as queries:
+                self.patch(
+                    [(ingredient, 2) for ingredient in ingredients[:size]]
+                )
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_ingredients_are_fetched_with_one_query(self):
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'специя {number}', measurement_unit='г'
+            )
+            for number in range(10)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(
+                [(ingredient, 1) for ingredient in ingredients]
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([
+            query for query in queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "recipes_ingredient"' in query['sql']
+        ]), 1)
+
+
+class SubscriptionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.authors = [create_user(f'author{number}') for number in range(4)]
+        for author in self.authors:
+            for name in ('Суп', 'Каша', 'Хлеб'):
+                create_recipe(author, name)
+        create_user('stranger')
+
+    def subscriptions(self, query=''):
+        response = self.client.get(f'/api/users/subscriptions/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_lists_only_subscribed_authors(self):
+        for author in self.authors[:2]:
+            Subscriptions.objects.create(user=self.user, subscribe=author)
+        Subscriptions.objects.create(
+            user=self.authors[2], subscribe=self.authors[3]
+        )
+        data = self.subscriptions()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(
+            {user['id'] for user in data['results']},
+            {author.pk for author in self.authors[:2]}
+        )
+        for user in data['results']:
+            self.assertTrue(user['is_subscribed'])
+            self.assertEqual(user['recipes_count'], 3)
+            self.assertEqual(len(user['recipes']), 3)
+
+    def test_recipes_limit(self):
+        for author in self.authors[:2]:
+            Subscriptions.objects.create(user=self.user, subscribe=author)
+        for query, names in (
+            ('recipes_limit=2', ['Каша', 'Суп']),
+            ('recipes_limit=0', []),
+            ('recipes_limit=abc', ['Каша', 'Суп', 'Хлеб']),
+            ('recipes_limit=-1', ['Каша', 'Суп', 'Хлеб']),
+        ):
+            for user in self.subscriptions(query)['results']:
+                self.assertEqual(
+                    [recipe['name'] for recipe in user['recipes']], names,
+                    query
+                )
+                self.assertEqual(user['recipes_count'], 3)
+
+    def test_limited_per_author(self):
+        author = self.authors[0]
+        first = Recipe.objects.get(author=author, name='Каша')
+        second = create_recipe(author, 'Каша')
+        recipes = Recipe.objects.limited_per_author(2)
+        self.assertEqual(len(recipes), 2 * len(self.authors))
+        # Ties on the name are broken by id.
+        self.assertEqual(
+            sorted(
+                recipe.pk for recipe in recipes
+                if recipe.author_id == author.pk
+            ),
+            [first.pk, second.pk]
+        )
+
+    def test_query_count_does_not_grow_with_authors(self):
+        counts = []
+        for authors in (self.authors[:2], self.authors[2:]):
+            for author in authors:
+                Subscriptions.objects.create(user=self.user, subscribe=author)
+            with CaptureQueriesContext(connection) as queries:
+                data = self.subscriptions('recipes_limit=2')
+            counts.append(len(queries))
+        self.assertEqual(data['count'], 4)
+        self.assertEqual(counts[0], counts[1])
+
+
+class ImageUploadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(ready_names.clear)
+        self.media_root = media_root
+
+    def stored_files(self):
+        return [
+            path.name for path in Path(self.media_root).rglob('*')
+            if path.is_file()
+        ]
+
+    def recipe_data(self, **data):
+        return {
+            'name': 'Суп',
+            'text': 'Сварить.',
+            'cooking_time': 10,
+            'image': base64_image(),
+            'ingredients': [{'id': self.salt.pk, 'amount': 5}],
+        } | data
+
+    def test_failed_requests_enqueue_nothing(self):
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(ingredients=[]), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/recipes/', self.recipe_data(
+            ingredients=[{'id': self.salt.pk, 'amount': 5}] * 2
+        ), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_undecodable_image_is_rejected_on_save(self):
+        data = b64decode(base64_image().split(',')[1])
+        response = self.client.post('/api/recipes/', self.recipe_data(
+            image='data:image/png;base64,' + b64encode(data[:-40]).decode()
+        ), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_concurrent_duplicate_is_not_left_behind(self):
+        storage = FileSystemStorage(location=self.media_root)
+        storage.save('recipes/a.jpg', BytesIO(b'jpeg'))
+        self.assertEqual(
+            save_once('recipes/a.jpg', b'jpeg', storage), 'recipes/a.jpg'
+        )
+        self.assertEqual(self.stored_files(), ['a.jpg'])
+
+    def test_saved_images_enqueue_variants(self):
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(), format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.put(
+            '/api/users/me/avatar/', {'avatar': base64_image('blue')},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        recipe = Recipe.objects.get()
+        self.assertEqual(
+            sorted(Task.objects.values_list('kwargs__name', flat=True)),
+            sorted([self.user.avatar.name, recipe.image.name])
+        )
+
+    def test_variants_fall_back_to_the_original_until_rendered(self):
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(), format='json'
+        )
+        recipe_id = response.data['id']
+        self.client.put(
+            '/api/users/me/avatar/', {'avatar': base64_image('blue')},
+            format='json'
+        )
+        recipe = self.client.get(f'/api/recipes/{recipe_id}/').data
+        avatar = self.client.get('/api/users/me/').data
+        for data, field in ((recipe, 'image'), (avatar, 'avatar')):
+            self.assertEqual(
+                {
+                    url for formats in data[f'{field}_variants'].values()
+                    for url in formats.values()
+                },
+                {data[field]}
+            )
+        image = Recipe.objects.get().image
+        self.assertEqual(
+            variant_url(image, RECIPE_IMAGE_SIZES, 'small'), image.url
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(run_pending_tasks(), 2)
+        recipe = self.client.get(f'/api/recipes/{recipe_id}/').data
+        self.assertTrue(
+            recipe['image_variants']['small']['webp'].endswith('_small.webp')
+        )
+        self.assertTrue(
+            recipe['author']['avatar_variants']['small']['jpeg'].endswith(
+                '_small.jpg'
+            )
+        )
+        url = variant_url(image, RECIPE_IMAGE_SIZES, 'small', 'webp')
+        self.assertTrue(image.storage.exists(
+            url.removeprefix(image.storage.base_url)
+        ))
+
+
+@override_settings(QUERY_BUDGET_ENFORCE=True)
+class QueryBudgetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.authors = [create_user(f'author{number}') for number in range(3)]
+        for number, author in enumerate(self.authors * 2):
+            recipe = create_recipe(
+                author, f'Рецепт {number}', [(self.salt, 1), (self.flour, 2)]
+            )
+            FavoriteRecipes.objects.create(user=self.user, recipe=recipe)
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        for author in self.authors:
+            Subscriptions.objects.create(user=self.user, subscribe=author)
+        self.recipe = recipe
+
+    def test_views_stay_within_their_budgets(self):
+        for url in (
+            '/api/recipes/',
+            '/api/recipes/?is_favorited=1&is_in_shopping_cart=1',
+            '/api/recipes/?pagination=cursor',
+            f'/api/recipes/{self.recipe.pk}/',
+            f'/api/recipes/{self.recipe.pk}/similar/',
+            '/api/users/',
+            '/api/users/me/',
+            '/api/users/subscriptions/?recipes_limit=1',
+            '/api/ingredients/?name=со',
+        ):
+            with self.subTest(url=url):
+                cache.clear()
+                self.assertEqual(self.client.get(url).status_code, 200)
+        for file_format in ('txt', 'csv'):
+            response = self.client.get(
+                f'/api/recipes/download_shopping_cart/?format={file_format}'
+            )
+            b''.join(response.streaming_content)
+
+    def test_exceeded_budget_raises_with_duplicates(self):
+        with (
+            mock.patch.object(
+                RecipeViewSet, 'query_budgets',
+                {**RecipeViewSet.query_budgets, 'list': 1}
+            ),
+            self.assertRaises(QueryBudgetExceeded) as error,
+        ):
+            self.client.get('/api/recipes/')
+        self.assertIn('"view": "RecipeViewSet.list"', str(error.exception))
+        self.assertIn('"budget": 1', str(error.exception))
+
+    def test_streamed_queries_are_counted(self):
+        with mock.patch.object(
+            RecipeViewSet.download_shopping_cart, 'query_budget', 1
+        ):
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/?format=txt'
+            )
+            self.assertEqual(response.status_code, 200)
+            with self.assertRaises(QueryBudgetExceeded):
+                b''.join(response.streaming_content)
+
+    @override_settings(
+        QUERY_BUDGET_ENFORCE=False, QUERY_BUDGET_SAMPLE_RATE=1.0
+    )
+    def test_sampled_requests_log_instead_of_raising(self):
+        with (
+            mock.patch.object(
+                RecipeViewSet, 'query_budgets',
+                {**RecipeViewSet.query_budgets, 'retrieve': 1}
+            ),
+            self.assertLogs('api.query_budget', 'WARNING') as logs,
+        ):
+            response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            logs.records[0].query_budget['view'], 'RecipeViewSet.retrieve'
+        )
+
+
+class RecipePayloadCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_user('author')
+        self.recipe = create_recipe(self.author, 'Суп', [(self.salt, 5)])
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def get(self):
+        data = self.client.get(self.url).data
+        self.assertCached(True)
+        return data
+
+    def assertCached(self, cached):
+        self.assertEqual(
+            self.recipe.pk in get_recipe_payloads([self.recipe.pk]), cached
+        )
+
+    def test_cached_payload_is_reused(self):
+        self.get()
+        with CaptureQueriesContext(connection) as queries:
+            self.get()
+        self.assertFalse(any(
+            'recipes_recipeingredient' in query['sql'] for query in queries
+        ))
+
+    def test_payload_is_dropped_after_the_commit(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.recipe.name = 'Борщ'
+            self.recipe.save()
+            self.assertCached(True)
+        self.assertTrue(callbacks)
+        self.assertCached(False)
+
+    def test_changes_reach_cached_payloads(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Борщ'
+            self.recipe.save()
+        self.assertEqual(self.get()['name'], 'Борщ')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.salt.measurement_unit = 'щепотка'
+            self.salt.save()
+        self.assertEqual(
+            self.get()['ingredients'][0]['measurement_unit'], 'щепотка'
+        )
+
+        item = self.recipe.recipe_ingredients.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            item.amount = 7
+            item.save()
+        self.assertEqual(self.get()['ingredients'][0]['amount'], 7)
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(
+                recipe=self.recipe, ingredient=self.flour, amount=1
+            )
+        self.assertEqual(len(self.get()['ingredients']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Иван'
+            self.author.save()
+        self.assertEqual(self.get()['author']['first_name'], 'Иван')
+
+    def test_last_login_keeps_cached_payloads(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save(update_fields=['last_login'])
+        self.assertCached(True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save(update_fields=['email'])
+        self.assertCached(False)
+
+
+class ShoppingListExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.author = create_user('author')
+        recipe = create_recipe(self.author, 'Суп', [(self.salt, 5)])
+        self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+
+    def assertValidPdf(self, content):
+        self.assertTrue(content.startswith(b'%PDF-'))
+        self.assertTrue(content.rstrip().endswith(b'%%EOF'))
+        # Every object listed in the cross-reference table starts at its
+        # offset.
+        offset = int(content[content.rindex(b'startxref') + 9:].split()[0])
+        lines = content[offset:].splitlines()
+        self.assertEqual(lines[0], b'xref')
+        first, count = map(int, lines[1].split())
+        for number, entry in enumerate(lines[2:2 + count], start=first):
+            position, generation, kind = entry.split()
+            if kind == b'n':
+                self.assertTrue(content[int(position):].startswith(
+                    f'{number} {int(generation)} obj'.encode()
+                ))
+
+    def test_pdf_is_rendered_by_the_worker(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=pdf'
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        url = response['Location']
+        self.assertEqual(self.client.get(url).status_code, 202)
+        other = APIClient()
+        other.force_authenticate(create_user('other'))
+        self.assertEqual(other.get(url).status_code, 404)
+
+        self.assertEqual(run_pending_tasks(), 1)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertValidPdf(b''.join(response.streaming_content))
+
+    def test_txt_matches_the_previous_format(self):
+        bread = create_recipe(
+            self.author, 'Хлеб', [(self.flour, 500), (self.salt, 1)]
+        )
+        self.client.post(f'/api/recipes/{bread.pk}/shopping_cart/')
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="shopping_list.txt"'
+        )
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            '\n'.join([
+                f'Список покупок на {datetime.now():%d.%m.%Y}',
+                'Пользователь: user',
+                '',
+                'Продукты к покупке:',
+                '1. Мука - 500 г',
+                '2. Соль - 6 г',
+                '',
+                'Продукты для рецептов:',
+                '- Суп (автор: author)',
+                '- Хлеб (автор: author)',
+            ]).encode()
+        )
+
+    def test_pdf_wraps_long_lines_onto_further_pages(self):
+        name = ' '.join(['очень длинное название продукта'] * 4)
+        for number in range(60):
+            ingredient = Ingredient.objects.create(
+                name=f'{name} {number}', measurement_unit='г'
+            )
+            recipe = create_recipe(
+                self.author, f'Рецепт {number}', [(ingredient, 1)]
+            )
+            self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        with render_pdf(self.user) as output:
+            content = output.read()
+        self.assertValidPdf(content)
+        self.assertGreater(len(re.findall(rb'/Type /Page\b', content)), 3)
+
+        font = get_pdf_font()
+        line = 'a' * 200 + ' ' + name
+        parts = wrap_pdf_line(line, font, 300)
+        self.assertGreater(len(parts), 3)
+        for part in parts:
+            self.assertLessEqual(
+                pdfmetrics.stringWidth(part, font, PDF_FONT_SIZE), 300
+            )
+        self.assertEqual(
+            ''.join(parts).replace(' ', ''), line.replace(' ', '')
+        )
+
+    def test_old_exports_are_purged_with_their_files(self):
+        self.client.get('/api/recipes/download_shopping_cart/?format=pdf')
+        run_pending_tasks()
+        export = ShoppingListExport.objects.get()
+        purge_shopping_list_exports()
+        self.assertTrue(ShoppingListExport.objects.exists())
+        ShoppingListExport.objects.update(
+            created_at=export.created_at - timedelta(days=2)
+        )
+        purge_shopping_list_exports()
+        self.assertFalse(ShoppingListExport.objects.exists())
+        self.assertTrue(
+            DeletedFile.objects.filter(name=export.file.name).exists()
+        )
+
+    def test_unknown_format(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=doc'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pdf', str(response.data['format']))
@@ -0,0 +1,81 @@
+import binascii
+from contextlib import ExitStack
+from tempfile import SpooledTemporaryFile
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files import File
+from PIL import Image, UnidentifiedImageError
+from rest_framework import serializers
+
+BASE64_HEADER = ';base64,'
+DECODE_CHUNK_SIZE = 64 * 1024
+UPLOAD_SPOOL_MAX_SIZE = 1024 * 1024
+ALLOWED_IMAGE_FORMATS = {
+    'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'
+}
+# Formats that render_variants can decode at a reduced scale.
+DRAFT_IMAGE_FORMATS = {'JPEG'}
+INVALID_IMAGE_MESSAGE = 'Загрузите корректное изображение.'
+
+
+def decode_base64(data, output, max_bytes):
+    start = data.find(BASE64_HEADER)
+    start = 0 if start == -1 else start + len(BASE64_HEADER)
+    if (len(data) - start) // 4 * 3 > max_bytes:
+        raise serializers.ValidationError(
+            f'Размер изображения превышает {max_bytes} байт.'
+        )
+    carry = ''
+    for position in range(start, len(data), DECODE_CHUNK_SIZE):
+        chunk = carry + ''.join(
+            data[position:position + DECODE_CHUNK_SIZE].split()
+        )
+        end = len(chunk) - len(chunk) % 4
+        carry = chunk[end:]
+        try:
+            output.write(binascii.a2b_base64(chunk[:end], strict_mode=True))
+        except binascii.Error:
+            raise serializers.ValidationError(INVALID_IMAGE_MESSAGE)
+    if carry:
+        raise serializers.ValidationError(INVALID_IMAGE_MESSAGE)
+
+
+def check_image_header(file, max_pixels, max_full_decode_pixels):
+    try:
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise serializers.ValidationError(INVALID_IMAGE_MESSAGE)
+    if image_format not in ALLOWED_IMAGE_FORMATS:
+        raise serializers.ValidationError(
+            'Допустимые форматы: JPEG, PNG, GIF, WebP.'
+        )
+    if image_format not in DRAFT_IMAGE_FORMATS:
+        max_pixels = min(max_pixels, max_full_decode_pixels)
+    if width * height > max_pixels:
+        raise serializers.ValidationError(
+            f'Изображение больше {max_pixels} пикселей.'
+        )
+    return ALLOWED_IMAGE_FORMATS[image_format]
+
+
+def base64_image_file(data):
+    # The decoded bytes go to a spooled file in small chunks, and only the
+    # header is parsed, so the full image is never held in memory here.
+    with ExitStack() as stack:
+        output = stack.enter_context(
+            SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_SIZE)
+        )
+        decode_base64(data, output, settings.IMAGE_UPLOAD_MAX_BYTES)
+        output.seek(0)
+        extension = check_image_header(
+            output,
+            settings.IMAGE_UPLOAD_MAX_PIXELS,
+            settings.IMAGE_UPLOAD_MAX_FULL_DECODE_PIXELS
+        )
+        output.seek(0)
+        # The file is handed over to the caller, it is closed only when
+        # validation fails.
+        stack.pop_all()
+    return File(output, name=f'{uuid4()}.{extension}')
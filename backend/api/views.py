@@ -1,31 +1,108 @@
+from types import MappingProxyType
+
 from rest_framework import viewsets, status
 from djoser.views import UserViewSet
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from django.http import FileResponse, Http404
 from django.shortcuts import get_object_or_404
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.db.models.functions import Greatest
 from rest_framework import serializers
 from django.urls import reverse
 
-from recipes.models import (Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, FavoriteRecipes)
+from recipes.ingredient_index import ingredient_index
+from recipes.pantry_index import pantry_index
+from recipes.models import (Ingredient, Recipe, ShoppingCart,
+                            ShoppingListExport, ShoppingListItem,
+                            FavoriteRecipes)
+from recipes.tasks import render_shopping_list_pdf
 from users.models import Subscriptions
-from .serializers import (IngredientSerializer, RecipeWriteSerializer,
-                          RecipeReadSerializer, ShortRecipesSerializer,
-                          SubscriptionsUserSerializer)
+from users.signals import counters_updated_in_bulk
+from .serializers import (BulkActionSerializer, IngredientSerializer,
+                          PantryRecipeSerializer, PantrySerializer,
+                          RecipeWriteSerializer, RecipeReadSerializer,
+                          ShortRecipesSerializer, SubscriptionsUserSerializer,
+                          get_recipes_limit)
 from .filters import IngredientFilter, RecipeFilter
+from .paginators import (CURSOR_PAGINATION_MODE, PAGINATION_MODE_PARAM,
+                         RecipeCursorPagination, UserCursorPagination)
 from .permissions import IsAuthorOrReadOnly
+from .query_budget import query_budget
+from .shopping_list import (EXPORT_FORMATS as SHOPPING_LIST_EXPORT_FORMATS,
+                            RENDERERS as SHOPPING_LIST_RENDERERS,
+                            ShoppingListContentNegotiation,
+                            shopping_list_response)
 
 
 User = get_user_model()
 
 
-class CustomUserViewSet(UserViewSet):
+def lock_user(user):
+    # Changes to one user's favorites, cart and subscriptions are serialized
+    # on the user row, so links read after the lock are current and counters
+    # are adjusted only for rows that really change.
+    list(User.objects.select_for_update().filter(
+        pk=user.pk
+    ).values_list('pk', flat=True))
+
+
+def bulk_action_results(add_ids, remove_ids, found, linked):
+    return [
+        {
+            'id': pk,
+            'action': 'add',
+            'status': 'not_found' if pk not in found
+            else 'exists' if pk in linked else 'added'
+        }
+        for pk in add_ids
+    ] + [
+        {
+            'id': pk,
+            'action': 'remove',
+            'status': 'not_found' if pk not in found
+            else 'removed' if pk in linked else 'absent'
+        }
+        for pk in remove_ids
+    ]
+
+
+class CursorPaginationMixin:
+    cursor_pagination_class = None
+    # Filters that order the results on their own, by rank for example. The
+    # cursor would replace that ordering, so such requests keep page numbers.
+    ordering_filter_params = ()
+
+    def uses_cursor_pagination(self):
+        params = self.request.query_params
+        if params.get(PAGINATION_MODE_PARAM) != CURSOR_PAGINATION_MODE:
+            return False
+        return not any(
+            params.get(name, '').strip()
+            for name in self.ordering_filter_params
+        )
+
+    @property
+    def paginator(self):
+        if self.uses_cursor_pagination() and not hasattr(self, '_paginator'):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
+
+
+class CustomUserViewSet(CursorPaginationMixin, UserViewSet):
+    cursor_pagination_class = UserCursorPagination
+    query_budgets = MappingProxyType({'list': 4, 'retrieve': 3})
+
+    def get_queryset(self):
+        return super().get_queryset().with_is_subscribed(self.request.user)
+
+    @query_budget(3)
     @action(
         detail=False,
         permission_classes=(IsAuthenticated,)
@@ -53,6 +130,7 @@ class CustomUserViewSet(UserViewSet):
             user.save()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @query_budget(6)
     @action(
         detail=False,
         methods=['get'],
@@ -60,8 +138,14 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = request.user
+        limit = get_recipes_limit(request)
+        recipes = Recipe.objects.all()
+        if limit is not None:
+            recipes = recipes.limited_per_author(limit)
         queryset = User.objects.filter(
-            subscriptions__user=user
+            subscribers__user=user
+        ).with_is_subscribed(user).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='preview_recipes')
         )
 
         page = self.paginate_queryset(queryset)
@@ -75,9 +159,11 @@ class CustomUserViewSet(UserViewSet):
         methods=['post', 'delete'],
         permission_classes=(IsAuthenticated,)
     )
+    @transaction.atomic
     def subscribe(self, request, id=None):
         user = request.user
         sub_user = self.get_object()
+        lock_user(user)
 
         if request.method == 'POST':
             if user == sub_user:
@@ -95,6 +181,7 @@ class CustomUserViewSet(UserViewSet):
                     f'Вы уже подписаны на пользователя {sub_user.username}'
                 )
 
+            sub_user.is_subscribed = True
             serializer = SubscriptionsUserSerializer(
                 sub_user, context={'request': request}
             )
@@ -110,6 +197,54 @@ class CustomUserViewSet(UserViewSet):
         ).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='subscribe/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def subscribe_bulk(self, request):
+        serializer = BulkActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+        add_ids = serializer.validated_data['add']
+        remove_ids = serializer.validated_data['remove']
+
+        with transaction.atomic(), counters_updated_in_bulk():
+            lock_user(user)
+            found = set(User.objects.filter(
+                pk__in=add_ids + remove_ids
+            ).exclude(pk=user.pk).values_list('pk', flat=True))
+            linked = set(Subscriptions.objects.filter(
+                user=user, subscribe_id__in=add_ids + remove_ids
+            ).values_list('subscribe_id', flat=True))
+            to_add = [
+                pk for pk in add_ids if pk in found and pk not in linked
+            ]
+            to_remove = [pk for pk in remove_ids if pk in linked]
+            Subscriptions.objects.bulk_create(
+                [Subscriptions(user=user, subscribe_id=pk) for pk in to_add],
+                ignore_conflicts=True
+            )
+            Subscriptions.objects.filter(
+                user=user, subscribe_id__in=to_remove
+            ).delete()
+            User.objects.filter(pk=user.pk).update(
+                subscriptions_count=Greatest(
+                    F('subscriptions_count') + len(to_add) - len(to_remove), 0
+                )
+            )
+            User.objects.filter(pk__in=to_add).update(
+                subscribers_count=F('subscribers_count') + 1
+            )
+            User.objects.filter(pk__in=to_remove).update(
+                subscribers_count=Greatest(F('subscribers_count') - 1, 0)
+            )
+
+        return Response({'results': bulk_action_results(
+            add_ids, remove_ids, found, linked
+        )})
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
@@ -118,12 +253,35 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    @query_budget(3)
+    def list(self, request, *args, **kwargs):
+        ingredients = ingredient_index.search(
+            request.query_params.get('name', ''),
+            settings.INGREDIENTS_SEARCH_LIMIT
+        )
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+class RecipeViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
+    queryset = Recipe.objects.defer('search_vector')
+    cursor_pagination_class = RecipeCursorPagination
+    ordering_filter_params = ('search',)
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
     permission_classes = [IsAuthorOrReadOnly, IsAuthenticatedOrReadOnly]
+    query_budgets = MappingProxyType({
+        'list': 6,
+        'retrieve': 5,
+        'create': 16,
+        'update': 16,
+        'partial_update': 16,
+    })
+
+    def get_queryset(self):
+        if self.action in ['list', 'retrieve', 'pantry']:
+            return super().get_queryset().with_user_flags(self.request.user)
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
@@ -133,9 +291,11 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
     def _handle_m2m_action(self, request, model):
         user = request.user
         recipe = self.get_object()
+        lock_user(user)
 
         if request.method == 'POST':
             obj, created = model.objects.get_or_create(
@@ -161,6 +321,45 @@ class RecipeViewSet(viewsets.ModelViewSet):
         ).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _handle_bulk_m2m_action(self, request, model, counter_field):
+        serializer = BulkActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+        add_ids = serializer.validated_data['add']
+        remove_ids = serializer.validated_data['remove']
+
+        with transaction.atomic(), counters_updated_in_bulk():
+            lock_user(user)
+            found = set(Recipe.objects.filter(
+                pk__in=add_ids + remove_ids
+            ).values_list('pk', flat=True))
+            linked = set(model.objects.filter(
+                user=user, recipe_id__in=add_ids + remove_ids
+            ).values_list('recipe_id', flat=True))
+            to_add = [
+                pk for pk in add_ids if pk in found and pk not in linked
+            ]
+            to_remove = [pk for pk in remove_ids if pk in linked]
+            model.objects.bulk_create(
+                [model(user=user, recipe_id=pk) for pk in to_add],
+                ignore_conflicts=True
+            )
+            model.objects.filter(user=user, recipe_id__in=to_remove).delete()
+            Recipe.objects.filter(pk__in=to_add).update(
+                **{counter_field: F(counter_field) + 1}
+            )
+            Recipe.objects.filter(pk__in=to_remove).update(
+                **{counter_field: Greatest(F(counter_field) - 1, 0)}
+            )
+            if model is ShoppingCart:
+                ShoppingListItem.objects.change_recipes(
+                    user.pk, added=to_add, removed=to_remove
+                )
+
+        return Response({'results': bulk_action_results(
+            add_ids, remove_ids, found, linked
+        )})
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -172,51 +371,93 @@ class RecipeViewSet(viewsets.ModelViewSet):
             ShoppingCart
         )
 
+    @query_budget(4)
+    @action(detail=False, methods=['get'])
+    def pantry(self, request):
+        serializer = PantrySerializer(data={
+            'ingredients': [
+                part for value in request.query_params.getlist('ingredients')
+                for part in value.split(',') if part
+            ],
+            'missing': request.query_params.get('missing', 0)
+        })
+        serializer.is_valid(raise_exception=True)
+        matches = pantry_index.search(
+            serializer.validated_data['ingredients'],
+            serializer.validated_data['missing']
+        )
+
+        # The ranked list comes from memory, so it is paged by number even
+        # when cursor pagination is requested.
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(matches, request, view=self)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in page]
+        )
+        for recipe_id, missing in page:
+            if recipe_id in recipes:
+                recipes[recipe_id].missing_count = missing
+        serializer = PantryRecipeSerializer(
+            [
+                recipes[recipe_id] for recipe_id, _ in page
+                if recipe_id in recipes
+            ],
+            many=True,
+            context={'request': request}
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @query_budget(4)
     @action(
         detail=False,
         methods=['get'],
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        content_negotiation_class=ShoppingListContentNegotiation
     )
     def download_shopping_cart(self, request):
-        from datetime import datetime
-        
-        shopping_cart = request.user.shopping_carts.select_related(
-            'recipe', 'recipe__author'
+        file_format = request.query_params.get('format', 'txt')
+        formats = [*SHOPPING_LIST_RENDERERS, *SHOPPING_LIST_EXPORT_FORMATS]
+        if file_format not in formats:
+            raise serializers.ValidationError(
+                {'format': f'Доступные форматы: {", ".join(formats)}.'}
+            )
+        if file_format in SHOPPING_LIST_EXPORT_FORMATS:
+            # Rendering a PDF takes too long for the request, the worker
+            # builds it and the client polls the returned URL.
+            with transaction.atomic():
+                export = ShoppingListExport.objects.create(user=request.user)
+                render_shopping_list_pdf.enqueue(export_id=export.pk)
+            return self.shopping_list_export_response(request, export)
+        return shopping_list_response(request.user, file_format)
+
+    @query_budget(2)
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path=r'download_shopping_cart/(?P<export_id>[0-9]+)',
+        permission_classes=(IsAuthenticated,)
+    )
+    def shopping_cart_export(self, request, export_id):
+        return self.shopping_list_export_response(request, get_object_or_404(
+            ShoppingListExport, pk=export_id, user=request.user
+        ))
+
+    def shopping_list_export_response(self, request, export):
+        if export.status == ShoppingListExport.Status.READY:
+            return FileResponse(
+                export.file.open('rb'),
+                as_attachment=True,
+                filename='shopping_list.pdf',
+                content_type='application/pdf'
+            )
+        url = request.build_absolute_uri(
+            reverse('recipe-shopping-cart-export', args=[export.pk])
         )
-        
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__in=shopping_cart.values('recipe')
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(total_amount=Sum('amount')).order_by('ingredient__name')
-
-        recipes = shopping_cart.all()
-
-        current_date = datetime.now().strftime('%d.%m.%Y')
-        
-        shopping_list = '\n'.join([
-            f'Список покупок на {current_date}',
-            f'Пользователь: {request.user.username}',
-            '',
-            'Продукты к покупке:',
-            *[
-                f'{i}. {item["ingredient__name"].capitalize()} - '
-                f'{item["total_amount"]} {item["ingredient__measurement_unit"]}'
-                for i, item in enumerate(ingredients, start=1)
-            ],
-            '',
-            'Продукты для рецептов:',
-            *[
-                f'- {recipe.recipe.name} (автор: {recipe.recipe.author.username})'
-                for recipe in recipes
-            ]
-        ])
-
-        return FileResponse(
-            shopping_list,
-            as_attachment=True,
-            filename='shopping_list.txt'
+        data = {'id': export.pk, 'status': export.status, 'url': url}
+        if export.status == ShoppingListExport.Status.FAILED:
+            return Response(data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(
+            data, status=status.HTTP_202_ACCEPTED, headers={'Location': url}
         )
 
     @action(
@@ -230,6 +471,47 @@ class RecipeViewSet(viewsets.ModelViewSet):
             FavoriteRecipes
         )
 
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='shopping_cart/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def shopping_cart_bulk(self, request):
+        return self._handle_bulk_m2m_action(
+            request,
+            ShoppingCart,
+            'shopping_carts_count'
+        )
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='favorite/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def favorite_bulk(self, request):
+        return self._handle_bulk_m2m_action(
+            request,
+            FavoriteRecipes,
+            'favorites_count'
+        )
+
+    @query_budget(5)
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        recipes = Recipe.objects.filter(
+            neighbor_of__recipe_id=pk
+        ).order_by('neighbor_of__rank').only(
+            'id', 'name', 'image', 'cooking_time'
+        )
+        if not recipes and not Recipe.objects.filter(id=pk).exists():
+            raise Http404(f'Рецепт с id={pk} не найден')
+        serializer = ShortRecipesSerializer(
+            recipes, many=True, context={'request': request}
+        )
+        return Response(serializer.data)
+
     @action(
         detail=True,
         methods=['get'],
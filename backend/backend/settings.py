@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -53,12 +54,12 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'api.apps.ApiConfig',
     'recipes.apps.RecipesConfig',
-
-    'django_cleanup.apps.CleanupConfig',
+    'tasks.apps.TasksConfig',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -103,6 +104,22 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# The cache holds the index version stamps and recipe payloads, so it must be
+# shared by every process: gunicorn workers, the task worker and management
+# commands. LocMemCache is only suitable for a single-process local run.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.redis.RedisCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'redis://redis:6379/0'),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -174,6 +191,19 @@ REST_FRAMEWORK = {
     }
 }
 
+# PostgreSQL text search configuration of the recipe search vector; existing
+# vectors are rebuilt with a data migration or any save of the recipe
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', 'russian')
+
+# Maximum number of ingredients returned by the autocomplete endpoint
+INGREDIENTS_SEARCH_LIMIT = int(os.getenv('INGREDIENTS_SEARCH_LIMIT', '100'))
+
+# TrueType font with Cyrillic glyphs for the PDF shopping list
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 # Djoser
 DJOSER = {
     'HIDE_USERS': False,
@@ -186,3 +216,24 @@ DJOSER = {
         'user': ('api.permissions.CurrentUserOrAdminOrReadOnly',),
     }
 }
+
+# Limits for Base64 image uploads, checked before the image is decoded.
+# JPEG is decoded at a reduced scale; other formats are decoded at full
+# size, four bytes a pixel, so they get a lower limit
+IMAGE_UPLOAD_MAX_BYTES = int(
+    os.getenv('IMAGE_UPLOAD_MAX_BYTES', str(10 * 1024 * 1024))
+)
+IMAGE_UPLOAD_MAX_PIXELS = int(os.getenv('IMAGE_UPLOAD_MAX_PIXELS', '24000000'))
+IMAGE_UPLOAD_MAX_FULL_DECODE_PIXELS = int(
+    os.getenv('IMAGE_UPLOAD_MAX_FULL_DECODE_PIXELS', '10000000')
+)
+
+# Per-view SQL query budgets: a sampled share of requests is checked and
+# logged when over budget; with enforcement on every request is checked and
+# an exceeded budget raises an error
+QUERY_BUDGET_SAMPLE_RATE = float(
+    os.getenv('QUERY_BUDGET_SAMPLE_RATE', '0.05')
+)
+QUERY_BUDGET_ENFORCE = (
+    os.getenv('QUERY_BUDGET_ENFORCE', 'False').lower() in ('true', '1')
+)
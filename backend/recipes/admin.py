@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.utils.html import mark_safe
+from .images import RECIPE_IMAGE_SIZES, variant_url
 from .models import Recipe, RecipeIngredient, Ingredient, FavoriteRecipes, ShoppingCart
 
 
@@ -77,9 +78,17 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     inlines = [RecipeIngredientAdminInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return (
+            queryset.search(search_term, ranked=False)
+            | queryset.filter(author__username__icontains=search_term.strip())
+        ), False
+
     @admin.display(description='В избранном')
     def get_favorite_count(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
     @admin.display(description='Продукты')
     def get_ingredients_list(self, obj):
@@ -93,7 +102,8 @@ class RecipeAdmin(admin.ModelAdmin):
     @admin.display(description='Картинка')
     def get_image_preview(self, obj):
         if obj.image:
-            return mark_safe(f'<img src="{obj.image.url}" width="50" height="50">')
+            url = variant_url(obj.image, RECIPE_IMAGE_SIZES, 'small')
+            return mark_safe(f'<img src="{url}" width="50" height="50">')
         return '-'
 
 
@@ -3,3 +3,4 @@ INGREDIENT_MEASUREMENT_MAX_LENGTH = 64
 RECIPE_NAME_MAX_LENGTH = 256
 MIN_COOKING_TIME = 1
 MIN_AMOUNT = 1
+SIMILAR_RECIPES_TOP_K = 10
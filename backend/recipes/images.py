@@ -0,0 +1,166 @@
+import hashlib
+import re
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .models import DeletedFile
+
+IMAGE_FORMATS = {
+    'jpeg': ('jpg', 'JPEG', {
+        'quality': 85, 'optimize': True, 'progressive': True
+    }),
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 6}),
+}
+FULL_SIZE = 'full'
+RECIPE_IMAGE_SIZES = {FULL_SIZE: 1200, 'medium': 480, 'small': 160}
+AVATAR_SIZES = {FULL_SIZE: 512, 'small': 64}
+PROCESSED_NAME = re.compile(r'^[0-9a-f]{64}\.jpg$')
+VARIANT_NAME = re.compile(r'^(?P<digest>[0-9a-f]{64})(_[a-z]+)?\.(jpg|webp)$')
+READY_NAMES_LIMIT = 10000
+
+ready_names = set()
+
+
+def is_processed(name):
+    return bool(name) and bool(
+        PROCESSED_NAME.match(PurePosixPath(name).name)
+    )
+
+
+def variant_name(name, label, image_format):
+    path = PurePosixPath(name)
+    stem = path.stem if label == FULL_SIZE else f'{path.stem}_{label}'
+    return str(path.with_name(f'{stem}.{IMAGE_FORMATS[image_format][0]}'))
+
+
+def source_name(name):
+    # Maps a stored variant back to the main file it was rendered from.
+    path = PurePosixPath(name)
+    match = VARIANT_NAME.match(path.name)
+    if match is None:
+        return name
+    return str(path.with_name(f'{match["digest"]}.jpg'))
+
+
+def all_variant_names(name):
+    if not is_processed(name):
+        return [name]
+    labels = {*RECIPE_IMAGE_SIZES, *AVATAR_SIZES}
+    return [
+        variant_name(name, label, image_format)
+        for label in sorted(labels) for image_format in IMAGE_FORMATS
+    ]
+
+
+def variants_ready(name, sizes, storage=default_storage):
+    # render_variants writes the smallest WebP last, so once it exists the
+    # other variants do too. Only positive answers are remembered, a missing
+    # file is checked again on the next call.
+    last = variant_name(name, min(sizes, key=sizes.get), 'webp')
+    if last in ready_names:
+        return True
+    if not storage.exists(last):
+        return False
+    if len(ready_names) >= READY_NAMES_LIMIT:
+        ready_names.clear()
+    ready_names.add(last)
+    return True
+
+
+def image_variants(name, sizes, storage=default_storage):
+    # Files uploaded before the pipeline have no variants, and new uploads
+    # have none until the worker renders them; every size falls back to the
+    # original then.
+    ready = is_processed(name) and variants_ready(name, sizes, storage)
+    return {
+        label: {
+            image_format: variant_name(name, label, image_format)
+            if ready else name
+            for image_format in IMAGE_FORMATS
+        }
+        for label in sizes
+    }
+
+
+def flatten(image):
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(file, sizes, image_formats=tuple(IMAGE_FORMATS)):
+    largest = max(sizes.values())
+    with Image.open(file) as source:
+        # JPEG can be decoded at a reduced scale that still covers the
+        # largest variant.
+        source.draft('RGB', (largest, largest))
+        image = flatten(source)
+    for label, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for image_format in image_formats:
+            _, pil_format, options = IMAGE_FORMATS[image_format]
+            output = BytesIO()
+            image.save(output, pil_format, **options)
+            yield label, image_format, output.getvalue()
+
+
+def save_once(name, content, storage):
+    # Names are content hashes, so a suffixed name returned by storage.save
+    # means a concurrent upload already wrote the same bytes under the
+    # original name; the duplicate is removed instead of being left behind.
+    saved = storage.save(name, ContentFile(content))
+    if saved != name:
+        storage.delete(saved)
+    return name
+
+
+def store_image(file, upload_to, sizes, storage=default_storage):
+    # Only the main JPEG is written here; the other variants are rendered
+    # from it by store_variants.
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    name = f'{upload_to.rstrip("/")}/{digest.hexdigest()}.jpg'
+    # An existing file may be tombstoned by an earlier delete. Dropping the
+    # tombstone first keeps reclaim_media away from it, and waits for a
+    # reclaim that has already locked it, so the check below sees the result.
+    DeletedFile.objects.filter(name=name).delete()
+    if storage.exists(name):
+        return name
+    file.seek(0)
+    for _, _, content in render_variants(
+        file, {FULL_SIZE: sizes[FULL_SIZE]}, ('jpeg',)
+    ):
+        save_once(name, content, storage)
+    return name
+
+
+def store_variants(name, sizes, storage=default_storage):
+    missing = {
+        label: size for label, size in sizes.items()
+        if any(
+            not storage.exists(variant_name(name, label, image_format))
+            for image_format in IMAGE_FORMATS
+        )
+    }
+    if not missing:
+        return
+    with storage.open(name) as file:
+        for label, image_format, content in render_variants(file, missing):
+            path = variant_name(name, label, image_format)
+            if not storage.exists(path):
+                save_once(path, content, storage)
+
+
+def variant_url(file, sizes, label, image_format='jpeg'):
+    return file.storage.url(
+        image_variants(file.name, sizes, file.storage)[label][image_format]
+    )
@@ -0,0 +1,73 @@
+from bisect import bisect_left
+from itertools import islice, takewhile
+from threading import Lock
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Ingredient
+
+INDEX_VERSION_KEY = 'ingredient-index-version'
+
+
+def fold_name(name):
+    return name.casefold().replace('ё', 'е')
+
+
+def bump_index_version():
+    # A process rebuilding before the commit would read the old rows under
+    # the new stamp and keep them until the next bump.
+    transaction.on_commit(
+        lambda: cache.set(INDEX_VERSION_KEY, uuid4().hex, None)
+    )
+
+
+class IngredientPrefixIndex:
+    def __init__(self):
+        self.lock = Lock()
+        self.data = (None, [], [])
+
+    def get_version(self):
+        version = cache.get(INDEX_VERSION_KEY)
+        if version is None:
+            cache.add(INDEX_VERSION_KEY, uuid4().hex, None)
+            version = cache.get(INDEX_VERSION_KEY)
+        return version
+
+    def rebuild(self, version):
+        rows = sorted(
+            (fold_name(name), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        self.data = (
+            version,
+            [row[0] for row in rows],
+            [
+                Ingredient(id=pk, name=name, measurement_unit=unit)
+                for _, pk, name, unit in rows
+            ]
+        )
+
+    def get_data(self):
+        version = self.get_version()
+        if self.data[0] != version:
+            with self.lock:
+                if self.data[0] != version:
+                    self.rebuild(version)
+        return self.data
+
+    def search(self, prefix, limit):
+        _, keys, ingredients = self.get_data()
+        prefix = fold_name(prefix)
+        start = bisect_left(keys, prefix)
+        matches = takewhile(
+            lambda item: item[0].startswith(prefix),
+            zip(islice(keys, start, None), islice(ingredients, start, None))
+        )
+        return [ingredient for _, ingredient in islice(matches, limit)]
+
+
+ingredient_index = IngredientPrefixIndex()
@@ -0,0 +1,282 @@
+import base64
+import json
+import tracemalloc
+from io import BytesIO
+from statistics import median, quantiles
+from time import perf_counter
+from urllib.parse import urlencode
+
+from api.cache import invalidate_recipe_payloads
+from api.query_budget import QueryBudgetExceeded
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from PIL import Image
+from recipes.models import FavoriteRecipes, Recipe, ShoppingCart
+from rest_framework.test import APIClient
+from users.models import Subscriptions
+
+User = get_user_model()
+
+METRICS = ('p50_ms', 'p95_ms', 'queries', 'memory_kb')
+# Differences below these are treated as noise whatever the threshold.
+NOISE_FLOOR = {'p50_ms': 1.0, 'p95_ms': 1.0, 'queries': 0, 'memory_kb': 64}
+
+
+def upload_image():
+    output = BytesIO()
+    Image.new('RGB', (64, 48), 'orange').save(output, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        output.getvalue()
+    ).decode()
+
+
+def has_related(model, field):
+    return Exists(model.objects.filter(**{field: OuterRef('pk')}))
+
+
+def find_regressions(baseline, results, threshold):
+    regressions = []
+    for name, metrics in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in METRICS:
+            old, new = previous[metric], metrics[metric]
+            # Query counts are deterministic, any increase is a regression.
+            limit = old if metric == 'queries' else old * (1 + threshold)
+            if new > limit and new - old > NOISE_FLOOR[metric]:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет задержку, число SQL-запросов и память горячих эндпоинтов '
+        'API и сравнивает их с сохранённой базовой линией'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=50,
+            help='Количество замеров на эндпоинт'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=3,
+            help='Количество прогревочных запросов'
+        )
+        parser.add_argument(
+            '--endpoint',
+            action='append',
+            dest='endpoints',
+            help='Имя эндпоинта (можно указать несколько раз)'
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='ID пользователя, от имени которого выполняются запросы'
+        )
+        parser.add_argument(
+            '--output',
+            help='Сохранить результаты в JSON-файл'
+        )
+        parser.add_argument(
+            '--compare',
+            help='JSON-файл с базовой линией для сравнения'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='Допустимый относительный рост задержки и памяти'
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('--iterations должен быть не меньше 2.')
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as file:
+                    baseline = json.load(file)['endpoints']
+            except (OSError, ValueError, KeyError) as error:
+                raise CommandError(
+                    f'Не удалось прочитать {options["compare"]}: {error}'
+                )
+        requests = self.build_requests(self.find_user(options['user']))
+        names = options['endpoints'] or list(requests)
+        unknown = set(names) - set(requests)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные эндпоинты: {", ".join(sorted(unknown))}. '
+                f'Доступные: {", ".join(requests)}.'
+            )
+        setup_test_environment()
+        try:
+            with override_settings(QUERY_BUDGET_ENFORCE=True):
+                results = {
+                    name: self.measure(requests[name], options)
+                    for name in names
+                }
+        finally:
+            teardown_test_environment()
+        for name, metrics in results.items():
+            self.stdout.write(
+                f'{name}: p50 {metrics["p50_ms"]:.2f} мс, '
+                f'p95 {metrics["p95_ms"]:.2f} мс, '
+                f'запросов {metrics["queries"]}, '
+                f'память {metrics["memory_kb"]:.0f} КБ'
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'database': connection.vendor,
+                    'iterations': options['iterations'],
+                    'endpoints': results,
+                }, file, ensure_ascii=False, indent=2)
+        if baseline is None:
+            return
+        regressions = find_regressions(
+            baseline, results, options['threshold']
+        )
+        for name, metric, old, new in regressions:
+            self.stderr.write(f'{name}.{metric}: {old} -> {new}')
+        if regressions:
+            raise CommandError(f'Найдено регрессий: {len(regressions)}.')
+        self.stdout.write(self.style.SUCCESS('Регрессий не найдено.'))
+
+    def find_user(self, user_id):
+        users = User.objects.all()
+        if user_id is not None:
+            users = users.filter(pk=user_id)
+        user = users.filter(
+            has_related(Recipe, 'author'),
+            has_related(FavoriteRecipes, 'user'),
+            has_related(ShoppingCart, 'user'),
+            has_related(Subscriptions, 'user')
+        ).order_by('pk').first()
+        if user is None:
+            raise CommandError(
+                'Нет пользователя с рецептами, избранным, списком покупок и '
+                'подписками. Заполните базу командой seed.'
+            )
+        return user
+
+    def build_requests(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        own = user.recipes.order_by('pk').first()
+        popular = Recipe.objects.order_by('-favorites_count', 'pk').first()
+        ingredients = list(own.recipe_ingredients.order_by(
+            'pk'
+        ).values_list('ingredient_id', 'ingredient__name', 'amount'))
+        ingredient_ids = ','.join(str(pk) for pk, _, _ in ingredients[:2])
+        payload = {
+            'name': f'{own.name} (бенчмарк)',
+            'text': own.text,
+            'cooking_time': own.cooking_time,
+            'ingredients': [
+                {'id': pk, 'amount': amount}
+                for pk, _, amount in ingredients
+            ],
+        }
+        # name, method, path, data, mutates
+        return {
+            name: (client, *request) for name, *request in (
+                ('recipe_list', 'get', '/api/recipes/', None, False),
+                ('recipe_list_cursor', 'get',
+                 '/api/recipes/?pagination=cursor', None, False),
+                ('recipe_list_favorited', 'get',
+                 '/api/recipes/?is_favorited=1', None, False),
+                ('recipe_list_in_cart', 'get',
+                 '/api/recipes/?is_in_shopping_cart=1', None, False),
+                ('recipe_list_author', 'get',
+                 f'/api/recipes/?author={popular.author_id}', None, False),
+                ('recipe_list_ingredients', 'get',
+                 f'/api/recipes/?ingredients={ingredient_ids}', None, False),
+                ('recipe_search', 'get', '/api/recipes/?' + urlencode(
+                    {'search': ingredients[0][1]}
+                ), None, False),
+                ('recipe_detail', 'get', f'/api/recipes/{popular.pk}/', None,
+                 False),
+                ('ingredients_autocomplete', 'get',
+                 '/api/ingredients/?' + urlencode(
+                     {'name': ingredients[0][1][:3]}
+                 ), None, False),
+                ('subscriptions', 'get',
+                 '/api/users/subscriptions/?recipes_limit=3', None, False),
+                ('shopping_list_txt', 'get',
+                 '/api/recipes/download_shopping_cart/?format=txt', None,
+                 False),
+                ('shopping_list_pdf_export', 'get',
+                 '/api/recipes/download_shopping_cart/?format=pdf', None,
+                 True),
+                ('recipe_create', 'post', '/api/recipes/',
+                 {**payload, 'image': upload_image()}, True),
+                ('recipe_update', 'patch', f'/api/recipes/{own.pk}/',
+                 payload, True),
+            )
+        }
+
+    def call(self, client, method, path, data, mutates):
+        try:
+            response = self.send(client, method, path, data, mutates)
+        except QueryBudgetExceeded as error:
+            raise CommandError(
+                f'{method.upper()} {path}: '
+                f'превышен бюджет SQL-запросов {error}'
+            )
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{method.upper()} {path}: {response.status_code} '
+                f'{response.getvalue()[:500]!r}'
+            )
+
+    def send(self, client, method, path, data, mutates):
+        if not mutates:
+            response = getattr(client, method)(path, data, format='json')
+            response.getvalue()
+        else:
+            # Writes are rolled back so that repeated runs see the same data.
+            with transaction.atomic():
+                response = getattr(client, method)(path, data, format='json')
+                transaction.set_rollback(True)
+            if response.status_code < 400:
+                invalidate_recipe_payloads([response.data['id']])
+        return response
+
+    def measure(self, request, options):
+        for _ in range(options['warmup']):
+            self.call(*request)
+        with CaptureQueriesContext(connection) as queries:
+            self.call(*request)
+        # The next request resets the query log, so count right away.
+        query_count = len(queries)
+        # Allocations are traced in a separate run because tracemalloc slows
+        # the request down.
+        tracemalloc.start()
+        self.call(*request)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        timings = []
+        for _ in range(options['iterations']):
+            start = perf_counter()
+            self.call(*request)
+            timings.append((perf_counter() - start) * 1000)
+        return {
+            'p50_ms': round(median(timings), 3),
+            'p95_ms': round(quantiles(timings, n=20)[-1], 3),
+            'queries': query_count,
+            'memory_kb': round(peak / 1024, 1),
+        }
@@ -0,0 +1,99 @@
+import random
+from statistics import mean, quantiles
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Q
+from recipes.models import Recipe, RecipeIngredient
+from recipes.pantry_index import get_index_version, pantry_index
+
+
+def search_sql(ingredient_ids, max_missing):
+    rows = Recipe.objects.order_by().annotate(
+        total=Count('recipe_ingredients'),
+        matched=Count(
+            'recipe_ingredients',
+            filter=Q(recipe_ingredients__ingredient__in=ingredient_ids)
+        )
+    ).filter(
+        matched__gt=0,
+        total__lte=F('matched') + max_missing
+    ).values_list('id', 'total', 'matched')
+    results = sorted(
+        (-matched / total, total - matched, recipe_id)
+        for recipe_id, total, matched in rows
+    )
+    return [(recipe_id, missing) for _, missing, recipe_id in results]
+
+
+def summary(timings):
+    p95 = quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+    return f'среднее {mean(timings) * 1000:.2f} мс, p95 {p95 * 1000:.2f} мс'
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск по запасам через индекс и через SQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=100,
+            help='Количество запросов'
+        )
+        parser.add_argument(
+            '--pantry-size',
+            type=int,
+            default=10,
+            help='Количество ингредиентов в одном запросе'
+        )
+        parser.add_argument(
+            '--missing',
+            type=int,
+            default=0,
+            help='Допустимое число недостающих ингредиентов'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Зерно генератора случайных чисел'
+        )
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(RecipeIngredient.objects.order_by(
+            'ingredient_id'
+        ).values_list('ingredient_id', flat=True).distinct())
+        if not ingredient_ids:
+            raise CommandError('Нет рецептов с ингредиентами.')
+        rng = random.Random(options['seed'])
+        size = min(options['pantry_size'], len(ingredient_ids))
+        pantries = [
+            rng.sample(ingredient_ids, size)
+            for _ in range(options['queries'])
+        ]
+
+        start = perf_counter()
+        pantry_index.rebuild(get_index_version())
+        self.stdout.write(
+            f'Построение индекса: {(perf_counter() - start) * 1000:.2f} мс'
+        )
+
+        timings = {'index': [], 'sql': []}
+        for pantry in pantries:
+            start = perf_counter()
+            expected = search_sql(pantry, options['missing'])
+            timings['sql'].append(perf_counter() - start)
+            start = perf_counter()
+            found = pantry_index.search(pantry, options['missing'])
+            timings['index'].append(perf_counter() - start)
+            if found != expected:
+                raise CommandError(
+                    f'Результаты не совпадают для набора {pantry}.'
+                )
+
+        self.stdout.write(f'SQL: {summary(timings["sql"])}')
+        self.stdout.write(f'Индекс: {summary(timings["index"])}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Ускорение: {mean(timings["sql"]) / mean(timings["index"]):.1f}x'
+        ))
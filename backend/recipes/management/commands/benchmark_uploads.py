@@ -0,0 +1,114 @@
+import base64
+import gc
+import multiprocessing
+import os
+import threading
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+from time import perf_counter, sleep
+
+from api.serializers import StrictBase64ImageField
+from django.core.management.base import BaseCommand, CommandError
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+
+STATM_PATH = '/proc/self/statm'
+SAMPLE_INTERVAL = 0.002
+DECODERS = {
+    'drf_extra_fields': Base64ImageField,
+    'streaming': StrictBase64ImageField,
+}
+
+
+def current_rss():
+    with open(STATM_PATH) as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def make_image(megapixels):
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    noise = Image.effect_noise((width, height), 64)
+    image = Image.merge('RGB', (noise, noise.rotate(90, expand=False), noise))
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=95)
+    return 'data:image/jpeg;base64,' + base64.b64encode(
+        output.getvalue()
+    ).decode()
+
+
+def measure(decoder, path, concurrency, results):
+    with open(path) as source:
+        data = source.read()
+    field = DECODERS[decoder]()
+    gc.collect()
+    baseline = peak = current_rss()
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, current_rss())
+            sleep(SAMPLE_INTERVAL)
+
+    def upload():
+        field.to_internal_value(data).close()
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    start = perf_counter()
+    workers = [threading.Thread(target=upload) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = perf_counter() - start
+    done.set()
+    sampler.join()
+    results.put((peak - baseline, elapsed))
+
+
+class Command(BaseCommand):
+    help = 'Измеряет пиковую память при параллельной загрузке изображений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--megapixels',
+            type=float,
+            default=8,
+            help='Размер тестового изображения в мегапикселях'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Количество одновременных загрузок'
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.exists(STATM_PATH):
+            raise CommandError(f'Нужен {STATM_PATH} (Linux).')
+        data = make_image(options['megapixels'])
+        self.stdout.write(f'Размер запроса: {len(data) / 2 ** 20:.1f} МБ')
+        with NamedTemporaryFile('w', suffix='.txt') as source:
+            source.write(data)
+            source.flush()
+            del data
+            # Each decoder runs in a fresh process so that one run's peak
+            # does not hide the other's.
+            context = multiprocessing.get_context('fork')
+            for decoder in DECODERS:
+                results = context.Queue()
+                process = context.Process(
+                    target=measure,
+                    args=(
+                        decoder, source.name, options['concurrency'], results
+                    )
+                )
+                process.start()
+                peak, elapsed = results.get()
+                process.join()
+                self.stdout.write(
+                    f'{decoder}: пик памяти +{peak / 2 ** 20:.1f} МБ, '
+                    f'{elapsed * 1000:.0f} мс'
+                )
@@ -0,0 +1,54 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from recipes import constants
+from recipes.similarity import METRICS, compute_neighbors, store_neighbors
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает похожие рецепты по составу ингредиентов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=constants.SIMILAR_RECIPES_TOP_K,
+            help='Количество похожих рецептов для каждого рецепта'
+        )
+        parser.add_argument(
+            '--metric',
+            choices=METRICS,
+            default='cosine',
+            help='Мера сходства'
+        )
+        parser.add_argument(
+            '--weighted',
+            action='store_true',
+            help='Учитывать количество ингредиентов (только для cosine)'
+        )
+        parser.add_argument(
+            '--recipe',
+            type=int,
+            action='append',
+            dest='recipe_ids',
+            help='ID рецепта (можно указать несколько раз)'
+        )
+
+    def handle(self, *args, **options):
+        if options['weighted'] and options['metric'] != 'cosine':
+            raise CommandError('--weighted работает только с cosine.')
+        if options['top_k'] < 1:
+            raise CommandError('--top-k должен быть больше нуля.')
+        start = perf_counter()
+        stored = store_neighbors(
+            compute_neighbors(
+                options['top_k'],
+                options['metric'],
+                options['weighted'],
+                options['recipe_ids']
+            ),
+            options['recipe_ids']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Сохранено {stored} связей за {perf_counter() - start:.1f} с.'
+        ))
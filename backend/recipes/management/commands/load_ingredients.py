@@ -1,38 +1,205 @@
+import csv
 import json
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from api.cache import invalidate_recipe_payloads
+from django.core.management.base import BaseCommand, CommandError
+from recipes.ingredient_index import bump_index_version
+from recipes.models import Ingredient, RecipeIngredient
 
-from recipes.models import Ingredient
+DEFAULT_PATH = 'data/ingredients.json'
+CHUNK_SIZE = 64 * 1024
+CSV_HEADER = ['name', 'measurement_unit']
+
+
+def read_json_array(file, chunk_size=CHUNK_SIZE):
+    # Decodes one array item at a time, so only the current chunk and item
+    # are held in memory.
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def next_token():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                return None
+            fill()
+
+    if next_token() != '[':
+        raise ValueError('ожидался JSON-массив')
+    position += 1
+    if next_token() == ']':
+        return
+    while True:
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        if end == len(buffer) and not eof:
+            fill()
+            continue
+        position = end
+        yield item
+        token = next_token()
+        position += 1
+        if token == ']':
+            return
+        if token != ',':
+            raise ValueError(f'неожиданный символ {token!r} в JSON-массиве')
+        next_token()
+
+
+def read_json(file):
+    for item in read_json_array(file):
+        if not isinstance(item, dict):
+            yield None
+            continue
+        yield item.get('name'), item.get('measurement_unit')
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row == CSV_HEADER:
+            continue
+        yield tuple(row) if len(row) == 2 else None
+
+
+READERS = {
+    'json': read_json,
+    'csv': read_csv,
+}
 
 
 class Command(BaseCommand):
-    help = 'Загружает ингредиенты из JSON в базу данных'
+    help = 'Загружает ингредиенты из JSON или CSV в базу данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=DEFAULT_PATH,
+            help='Файл с ингредиентами'
+        )
+        parser.add_argument(
+            '--format',
+            choices=READERS,
+            help='Формат файла, по умолчанию определяется по расширению'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк, записываемых за один запрос'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только подсчитать изменения, не записывая их'
+        )
 
     def handle(self, *args, **options):
-        filename = 'data/ingredients.json'
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(
+                f'Не удалось определить формат файла {path}, укажите --format.'
+            )
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        self.verbosity = options['verbosity']
+        self.counts = dict.fromkeys(
+            ('inserted', 'updated', 'skipped', 'invalid'), 0
+        )
         try:
-            with open(filename, 'r', encoding='utf-8') as ingredients_data:
-                ingredients = json.load(ingredients_data)
+            with open(path, encoding='utf-8', newline='') as file:
+                rows = self.clean_rows(READERS[file_format](file))
+                while batch := list(islice(rows, options['batch_size'])):
+                    self.load_batch(batch, options['dry_run'])
+                    self.report_progress()
+        except (OSError, UnicodeDecodeError, ValueError, csv.Error) as error:
+            raise CommandError(
+                f'Ошибка при загрузке ингредиентов из файла {path}: {error}'
+            )
+        prefix = 'Проверка без записи: ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}добавлено {self.counts["inserted"]}, '
+            f'обновлено {self.counts["updated"]}, '
+            f'без изменений {self.counts["skipped"]}, '
+            f'с ошибками {self.counts["invalid"]}.'
+        ))
 
-            ingredient_objects = [
-                Ingredient(**item)
-                for item in ingredients
-            ]
+    def clean_rows(self, rows):
+        name_length = Ingredient._meta.get_field('name').max_length
+        unit_length = Ingredient._meta.get_field(
+            'measurement_unit'
+        ).max_length
+        for number, row in enumerate(rows, 1):
+            name, unit = row if row is not None else (None, None)
+            name = name.strip() if isinstance(name, str) else ''
+            unit = unit.strip() if isinstance(unit, str) else ''
+            if not (
+                0 < len(name) <= name_length and 0 < len(unit) <= unit_length
+            ):
+                self.counts['invalid'] += 1
+                self.stderr.write(f'Строка {number} пропущена: {row!r}')
+                continue
+            yield name, unit
 
-            created_ingredients = Ingredient.objects.bulk_create(
-                ingredient_objects,
-                ignore_conflicts=True
+    def load_batch(self, batch, dry_run):
+        units = dict(batch)
+        self.counts['skipped'] += len(batch) - len(units)
+        existing = dict(Ingredient.objects.filter(
+            name__in=units
+        ).values_list('name', 'measurement_unit'))
+        changed = []
+        updated = []
+        for name, unit in units.items():
+            if name not in existing:
+                self.counts['inserted'] += 1
+            elif existing[name] != unit:
+                self.counts['updated'] += 1
+                updated.append(name)
+            else:
+                self.counts['skipped'] += 1
+                continue
+            changed.append(Ingredient(name=name, measurement_unit=unit))
+        if dry_run or not changed:
+            return
+        Ingredient.objects.bulk_create(
+            changed,
+            update_conflicts=True,
+            unique_fields=['name'],
+            update_fields=['measurement_unit']
+        )
+        # bulk_create sends no signals, so the caches the Ingredient signals
+        # keep in sync are refreshed here after every written batch.
+        if updated:
+            invalidate_recipe_payloads(
+                RecipeIngredient.objects.filter(
+                    ingredient__name__in=updated
+                ).values_list('recipe_id', flat=True).distinct()
             )
+        bump_index_version()
 
+    def report_progress(self):
+        if self.verbosity > 1:
             self.stdout.write(
-                self.style.SUCCESS(
-                    f'Успешно добавлено {len(created_ingredients)} ингредиентов!'
-                )
-            )
-
-        except Exception as e:
-            self.stderr.write(
-                self.style.ERROR(
-                    f'Ошибка при загрузке ингредиентов из файла {filename}: {e}'
-                )
+                f'Обработано строк: {sum(self.counts.values())}'
             )
@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from recipes.images import (
+    AVATAR_SIZES,
+    RECIPE_IMAGE_SIZES,
+    is_processed,
+    store_image,
+    store_variants,
+)
+from recipes.models import Recipe
+
+User = get_user_model()
+
+IMAGE_FIELDS = (
+    (Recipe, 'image', RECIPE_IMAGE_SIZES),
+    (User, 'avatar', AVATAR_SIZES),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Переводит загруженные ранее изображения на имена по хешу '
+        'и создаёт уменьшенные JPEG/WebP копии'
+    )
+
+    def handle(self, *args, **options):
+        for model, field_name, sizes in IMAGE_FIELDS:
+            upload_to = model._meta.get_field(field_name).upload_to
+            processed = 0
+            objects = model.objects.exclude(
+                **{field_name: ''}
+            ).exclude(**{f'{field_name}__isnull': True}).only(field_name)
+            for obj in objects.iterator():
+                file = getattr(obj, field_name)
+                if not file.storage.exists(file.name):
+                    self.stderr.write(
+                        f'{model._meta.label} {obj.pk}: '
+                        f'файл {file.name} не найден'
+                    )
+                    continue
+                if is_processed(file.name):
+                    store_variants(file.name, sizes, file.storage)
+                    continue
+                with file.open('rb'):
+                    name = store_image(file, upload_to, sizes, file.storage)
+                store_variants(name, sizes, file.storage)
+                setattr(obj, field_name, name)
+                obj.save(update_fields=[field_name])
+                processed += 1
+            self.stdout.write(
+                f'{model._meta.label}.{field_name}: обработано {processed}'
+            )
+        self.stdout.write(
+            self.style.SUCCESS('Обработка изображений завершена.')
+        )
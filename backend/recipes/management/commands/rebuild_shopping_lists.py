@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает агрегированные списки покупок пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='ID пользователя (можно указать несколько раз)'
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сравнить сохранённые суммы с пересчитанными'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not options['verify']:
+            count = ShoppingListItem.objects.rebuild(user_ids)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Пересчитано {count} позиций списков покупок.'
+                )
+            )
+            return
+
+        expected = ShoppingListItem.objects.compute_totals(user_ids)
+        stored = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        actual = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in stored.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )
+        }
+        mismatches = [
+            (key, actual.get(key), expected.get(key))
+            for key in expected.keys() | actual.keys()
+            if actual.get(key) != expected.get(key)
+        ]
+        for key, stored_total, expected_total in mismatches:
+            user_id, ingredient_id = key
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'сохранено {stored_total}, ожидается {expected_total}'
+            )
+        if mismatches:
+            self.stderr.write(
+                self.style.ERROR(f'Найдено расхождений: {len(mismatches)}.')
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS('Расхождений не найдено.'))
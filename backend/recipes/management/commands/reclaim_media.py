@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from recipes.media import (
+    find_orphaned_files,
+    reclaim_deleted_files,
+    record_deleted_files,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы, отмеченные как удалённые, и ищет в MEDIA_ROOT '
+        'файлы, на которые не ссылается ни одна запись'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество отметок об удалении, обрабатываемых за раз'
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help='Не трогать файлы и отметки моложе указанного числа секунд'
+        )
+        parser.add_argument(
+            '--sweep',
+            action='store_true',
+            help=(
+                'Также отметить файлы без ссылок из базы данных; они '
+                'удаляются следующими запусками, когда отметки устареют'
+            )
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        min_age = timedelta(seconds=options['min_age'])
+        dry_run = options['dry_run']
+        reclaimed, kept, files = reclaim_deleted_files(
+            options['batch_size'], min_age, default_storage, dry_run
+        )
+        self.stdout.write(
+            f'Отметок об удалении: освобождено {reclaimed}, '
+            f'используются повторно {kept}, файлов удалено {files}'
+        )
+        if options['sweep']:
+            try:
+                root = default_storage.path('')
+            except NotImplementedError:
+                raise CommandError(
+                    'Поиск файлов без ссылок работает только с локальным '
+                    'хранилищем.'
+                )
+            # Orphans are only tombstoned. An upload that is reusing one of
+            # them drops the tombstone or has committed its row by the time
+            # the tombstone is old enough to be reclaimed.
+            orphans = []
+            size = 0
+            for name, file_size in find_orphaned_files(root, min_age):
+                if dry_run:
+                    self.stdout.write(name)
+                orphans.append(name)
+                size += file_size
+            if not dry_run:
+                record_deleted_files(orphans)
+            self.stdout.write(
+                f'Файлов без ссылок: {len(orphans)}, {size / 2 ** 20:.1f} МБ'
+            )
+        self.stdout.write(self.style.SUCCESS('Очистка медиафайлов завершена.'))
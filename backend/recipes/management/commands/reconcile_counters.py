@@ -0,0 +1,54 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import FavoriteRecipes, Recipe, ShoppingCart
+from users.models import Subscriptions
+
+User = get_user_model()
+
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteRecipes, 'recipe'),
+    (Recipe, 'shopping_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscriptions, 'subscribe'),
+    (User, 'subscriptions_count', Subscriptions, 'user'),
+)
+
+
+def count_related(related_model, fk_field):
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{fk_field: OuterRef('pk')}
+        ).order_by().values(fk_field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Сверяет и исправляет денормализованные счётчики'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, не исправляя их'
+        )
+
+    def handle(self, *args, **options):
+        for model, field, related_model, fk_field in COUNTERS:
+            actual = count_related(related_model, fk_field)
+            drifted = model.objects.annotate(actual=actual).exclude(
+                **{field: F('actual')}
+            ).values('pk')
+            if options['dry_run']:
+                fixed = drifted.count()
+            else:
+                fixed = model.objects.filter(pk__in=drifted).update(
+                    **{field: actual}
+                )
+            self.stdout.write(
+                f'{model._meta.label}.{field}: расхождений {fixed}'
+            )
+        self.stdout.write(self.style.SUCCESS('Сверка счётчиков завершена.'))
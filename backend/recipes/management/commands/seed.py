@@ -0,0 +1,381 @@
+import csv
+from io import BytesIO, StringIO
+from time import perf_counter
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files import File
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+from recipes import constants
+from recipes.images import RECIPE_IMAGE_SIZES, store_image, store_variants
+from recipes.models import (
+    FavoriteRecipes,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+    recipe_search_vector,
+)
+from recipes.pantry_index import invalidate_index
+from users.models import Subscriptions
+
+User = get_user_model()
+
+DISHES = (
+    'Салат', 'Суп', 'Рагу', 'Запеканка', 'Пирог', 'Омлет', 'Каша',
+    'Паста', 'Плов', 'Соус', 'Смузи', 'Оладьи', 'Жаркое', 'Гарнир',
+)
+MAX_AMOUNT = 1000
+
+
+def zipf_weights(size, exponent, rng):
+    # Rank-based power law; the ranks are shuffled so that popularity is not
+    # correlated with insertion order.
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def sample_pairs(rng, counts, targets, weights, exclude_self=False):
+    # Samples with replacement and drops duplicates, which is much faster than
+    # sampling without replacement per owner; totals come out slightly lower.
+    owners = np.repeat(np.arange(len(counts)), counts)
+    chosen = rng.choice(targets, size=owners.size, p=weights)
+    keys = np.unique(owners * targets + chosen)
+    owners, chosen = np.divmod(keys, targets)
+    if exclude_self:
+        keep = owners != chosen
+        owners, chosen = owners[keep], chosen[keep]
+    return owners, chosen
+
+
+def placeholder_image():
+    gradient = Image.linear_gradient('L').resize((1200, 900))
+    image = Image.merge('RGB', (gradient, gradient.rotate(90), gradient))
+    output = BytesIO()
+    image.save(output, 'JPEG')
+    file = File(output, name='seed.jpg')
+    name = store_image(file, Recipe._meta.get_field('image').upload_to,
+                       RECIPE_IMAGE_SIZES)
+    store_variants(name, RECIPE_IMAGE_SIZES)
+    return name
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими данными для нагрузочного тестирования'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=1000,
+            help='Количество пользователей'
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=10000,
+            help='Количество рецептов'
+        )
+        parser.add_argument(
+            '--min-ingredients',
+            type=int,
+            default=3,
+            help='Минимальное число ингредиентов в рецепте'
+        )
+        parser.add_argument(
+            '--max-ingredients',
+            type=int,
+            default=12,
+            help='Максимальное число ингредиентов в рецепте'
+        )
+        parser.add_argument(
+            '--favorites',
+            type=float,
+            default=20,
+            help='Среднее число избранных рецептов у пользователя'
+        )
+        parser.add_argument(
+            '--carts',
+            type=float,
+            default=3,
+            help='Среднее число рецептов в списке покупок'
+        )
+        parser.add_argument(
+            '--subscriptions',
+            type=float,
+            default=10,
+            help='Среднее число подписок у пользователя'
+        )
+        parser.add_argument(
+            '--author-skew',
+            type=float,
+            default=1.1,
+            help='Показатель степенного распределения рецептов по авторам'
+        )
+        parser.add_argument(
+            '--popularity-skew',
+            type=float,
+            default=1.1,
+            help='Показатель степенного распределения популярности рецептов'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Количество строк, записываемых за один запрос'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Зерно генератора случайных чисел'
+        )
+        parser.add_argument(
+            '--prefix',
+            default='seed',
+            help='Префикс логинов создаваемых пользователей'
+        )
+        parser.add_argument(
+            '--password',
+            default='seed-password',
+            help='Пароль создаваемых пользователей'
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Писать через bulk_create даже в PostgreSQL'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users должен быть больше нуля.')
+        if not (
+            1 <= options['min_ingredients'] <= options['max_ingredients']
+        ):
+            raise CommandError(
+                'Неверный диапазон числа ингредиентов в рецепте.'
+            )
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        if User.objects.filter(
+            username__startswith=options['prefix']
+        ).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {options["prefix"]} уже есть, '
+                'укажите другой --prefix.'
+            )
+        ingredients = list(Ingredient.objects.order_by('id').values_list(
+            'id', 'name'
+        ))
+        if len(ingredients) < options['max_ingredients']:
+            raise CommandError(
+                'Недостаточно ингредиентов, сначала выполните '
+                'load_ingredients.'
+            )
+        self.options = options
+        self.rng = np.random.default_rng(options['seed'])
+        self.author_weights = zipf_weights(
+            options['users'], options['author_skew'], self.rng
+        )
+        self.use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        start = perf_counter()
+        with transaction.atomic():
+            user_ids = self.stage('Пользователи', self.seed_users)
+            recipe_ids = self.stage(
+                'Рецепты', self.seed_recipes, user_ids, ingredients
+            )
+            self.stage('Избранное', self.seed_relations, FavoriteRecipes,
+                       user_ids, recipe_ids, options['favorites'])
+            self.stage('Списки покупок', self.seed_relations, ShoppingCart,
+                       user_ids, recipe_ids, options['carts'])
+            self.stage('Подписки', self.seed_subscriptions, user_ids)
+            self.stage('Производные данные', self.update_derived, user_ids,
+                       recipe_ids)
+        invalidate_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные созданы за {perf_counter() - start:.1f} с. '
+            'Похожие рецепты пересчитывает build_similar_recipes.'
+        ))
+
+    def stage(self, title, func, *args):
+        start = perf_counter()
+        result = func(*args)
+        count = f'{len(result)}, ' if result is not None else ''
+        self.stdout.write(f'{title}: {count}{perf_counter() - start:.1f} с')
+        return result
+
+    def insert(self, model, fields, rows):
+        # rows is an iterable of column tuples in the order of fields.
+        batch_size = self.options['batch_size']
+        rows = iter(rows)
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                return
+            if self.use_copy:
+                self.copy(model, fields, batch)
+            else:
+                model.objects.bulk_create(
+                    [model(**dict(zip(fields, row))) for row in batch],
+                    batch_size=batch_size
+                )
+
+    def copy(self, model, fields, rows):
+        buffer = StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        columns = ', '.join(
+            quote(model._meta.get_field(field).column) for field in fields
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {quote(model._meta.db_table)} ({columns}) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+
+    def new_ids(self, model, last_id):
+        return np.fromiter(model.objects.filter(pk__gt=last_id).order_by(
+            'pk'
+        ).values_list('pk', flat=True).iterator(), dtype=np.int64)
+
+    def last_id(self, model):
+        return model.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+
+    def seed_users(self):
+        prefix = self.options['prefix']
+        password = make_password(self.options['password'])
+        now = timezone.now()
+        last_id = self.last_id(User)
+        self.insert(User, (
+            'username', 'email', 'first_name', 'last_name', 'password',
+            'is_active', 'is_staff', 'is_superuser', 'date_joined',
+            'recipes_count', 'subscribers_count', 'subscriptions_count',
+        ), (
+            (f'{prefix}{number}', f'{prefix}{number}@example.com',
+             'Тест', f'Пользователь {number}', password,
+             True, False, False, now, 0, 0, 0)
+            for number in range(self.options['users'])
+        ))
+        return self.new_ids(User, last_id)
+
+    def seed_recipes(self, user_ids, ingredients):
+        rng = self.rng
+        count = self.options['recipes']
+        ingredient_ids = np.array([pk for pk, _ in ingredients])
+        ingredient_names = [name for _, name in ingredients]
+        ingredient_weights = zipf_weights(len(ingredients), 1.0, rng)
+        authors = user_ids[rng.choice(
+            len(user_ids), size=count, p=self.author_weights
+        )]
+        dishes = rng.integers(len(DISHES), size=count)
+        main = rng.choice(len(ingredients), size=count, p=ingredient_weights)
+        cooking_times = np.clip(
+            rng.lognormal(3.2, 0.6, size=count).astype(np.int64),
+            constants.MIN_COOKING_TIME, 600
+        )
+        image = placeholder_image()
+        last_id = self.last_id(Recipe)
+        self.insert(Recipe, (
+            'name', 'text', 'cooking_time', 'image', 'author_id',
+            'favorites_count', 'shopping_carts_count',
+        ), (
+            (
+                f'{DISHES[dish]}: {ingredient_names[ingredient]}'[
+                    :constants.RECIPE_NAME_MAX_LENGTH
+                ],
+                (
+                    f'Смешать {ingredient_names[ingredient]} с остальными '
+                    f'ингредиентами и готовить {cooking_time} мин.'
+                ),
+                cooking_time, image, author, 0, 0
+            )
+            for dish, ingredient, cooking_time, author in zip(
+                dishes.tolist(), main.tolist(), cooking_times.tolist(),
+                authors.tolist()
+            )
+        ))
+        recipe_ids = self.new_ids(Recipe, last_id)
+
+        # Every recipe contains the ingredient from its name.
+        sizes = rng.integers(
+            self.options['min_ingredients'],
+            self.options['max_ingredients'] + 1,
+            size=count
+        ) - 1
+        recipes = np.concatenate([
+            np.arange(count), np.repeat(np.arange(count), sizes)
+        ])
+        chosen = np.concatenate([main, rng.choice(
+            len(ingredients), size=int(sizes.sum()), p=ingredient_weights
+        )])
+        recipes, chosen = np.divmod(
+            np.unique(recipes * len(ingredients) + chosen), len(ingredients)
+        )
+        amounts = rng.integers(constants.MIN_AMOUNT, MAX_AMOUNT,
+                               size=recipes.size)
+        self.insert(
+            RecipeIngredient,
+            ('recipe_id', 'ingredient_id', 'amount'),
+            zip(recipe_ids[recipes].tolist(),
+                ingredient_ids[chosen].tolist(), amounts.tolist())
+        )
+        return recipe_ids
+
+    def seed_relations(self, model, user_ids, recipe_ids, mean):
+        if not len(recipe_ids):
+            return []
+        users, recipes = sample_pairs(
+            self.rng,
+            self.rng.poisson(mean, size=len(user_ids)),
+            len(recipe_ids),
+            zipf_weights(
+                len(recipe_ids), self.options['popularity_skew'], self.rng
+            )
+        )
+        self.insert(model, ('user_id', 'recipe_id'), zip(
+            user_ids[users].tolist(), recipe_ids[recipes].tolist()
+        ))
+        return users
+
+    def seed_subscriptions(self, user_ids):
+        # Prolific authors attract more subscribers.
+        users, authors = sample_pairs(
+            self.rng,
+            self.rng.poisson(self.options['subscriptions'],
+                             size=len(user_ids)),
+            len(user_ids),
+            self.author_weights,
+            exclude_self=True
+        )
+        self.insert(Subscriptions, ('user_id', 'subscribe_id'), zip(
+            user_ids[users].tolist(), user_ids[authors].tolist()
+        ))
+        return users
+
+    def update_derived(self, user_ids, recipe_ids):
+        # Rows written in bulk bypass the signals that keep these in sync.
+        if connection.vendor == 'postgresql' and len(recipe_ids):
+            Recipe.objects.filter(pk__gte=int(recipe_ids[0])).update(
+                search_vector=recipe_search_vector()
+            )
+        call_command('reconcile_counters', stdout=StringIO())
+        batch_size = self.options['batch_size']
+        for start in range(0, len(user_ids), batch_size):
+            ShoppingListItem.objects.rebuild(
+                user_ids[start:start + batch_size].tolist()
+            )
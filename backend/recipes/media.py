@@ -0,0 +1,155 @@
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.utils import timezone
+
+from .images import all_variant_names, source_name
+from .models import DeletedFile
+
+
+def file_fields(model):
+    return [
+        field for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField)
+    ]
+
+
+def loaded_file_names(instance):
+    # Reads the raw values so that deferred fields are not fetched.
+    names = {}
+    for field in file_fields(type(instance)):
+        if field.attname in instance.__dict__:
+            value = instance.__dict__[field.attname]
+            names[field.attname] = getattr(value, 'name', value) or ''
+    return names
+
+
+def remember_file_names(instance):
+    instance._stored_file_names = loaded_file_names(instance)
+
+
+def replaced_file_names(instance, update_fields=None):
+    stored = getattr(instance, '_stored_file_names', {})
+    current = loaded_file_names(instance)
+    return {
+        attname: (stored[attname], name)
+        for attname, name in current.items()
+        if attname in stored and stored[attname] != name
+        and (update_fields is None or attname in update_fields)
+    }
+
+
+def record_deleted_files(names):
+    names = {name for name in names if name}
+    if names:
+        DeletedFile.objects.bulk_create(
+            [DeletedFile(name=name) for name in names],
+            ignore_conflicts=True
+        )
+
+
+def forget_deleted_files(names):
+    # A re-uploaded image reuses its hashed name, so its tombstone must go.
+    names = {name for name in names if name}
+    if names:
+        DeletedFile.objects.filter(name__in=names).delete()
+
+
+def file_field_models():
+    for model in apps.get_models():
+        fields = file_fields(model)
+        if fields:
+            yield model, fields
+
+
+def referenced_names(names=None):
+    referenced = set()
+    for model, fields in file_field_models():
+        for field in fields:
+            values = model._default_manager.exclude(
+                **{field.name: ''}
+            ).exclude(**{f'{field.name}__isnull': True})
+            if names is not None:
+                values = values.filter(**{f'{field.name}__in': names})
+            referenced.update(
+                values.values_list(field.name, flat=True).iterator()
+            )
+    return referenced
+
+
+def delete_stored_file(name, storage=default_storage, dry_run=False):
+    deleted = 0
+    for path in all_variant_names(name):
+        if storage.exists(path):
+            if not dry_run:
+                storage.delete(path)
+            deleted += 1
+    return deleted
+
+
+def reclaim_deleted_files(batch_size=500, min_age=timedelta(hours=1),
+                          storage=default_storage, dry_run=False):
+    # Each batch is locked until its files are gone. store_image drops the
+    # tombstone of a file it is about to reuse, so it either takes the row
+    # first and the batch skips it, or waits for the commit and then finds
+    # the file missing and writes it again.
+    cutoff = timezone.now() - min_age
+    reclaimed = kept = files = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(DeletedFile.objects.select_for_update(
+                skip_locked=True
+            ).filter(
+                deleted_at__lte=cutoff, pk__gt=last_pk
+            ).order_by('pk').values_list('pk', 'name')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            names = {name for _, name in batch}
+            referenced = referenced_names(
+                names | {source_name(name) for name in names}
+            )
+            in_use = {
+                name for name in names
+                if name in referenced or source_name(name) in referenced
+            }
+            for name in names - in_use:
+                files += delete_stored_file(name, storage, dry_run)
+            reclaimed += len(names - in_use)
+            kept += len(in_use)
+            if not dry_run:
+                DeletedFile.objects.filter(
+                    pk__in=[pk for pk, _ in batch]
+                ).delete()
+    return reclaimed, kept, files
+
+
+def walk_files(root):
+    directories = [root]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def find_orphaned_files(root, min_age=timedelta(hours=1)):
+    # Files newer than min_age may belong to an upload whose row has not been
+    # committed yet.
+    referenced = referenced_names()
+    cutoff = (timezone.now() - min_age).timestamp()
+    root = Path(root)
+    for entry in walk_files(root):
+        name = Path(entry.path).relative_to(root).as_posix()
+        if source_name(name) in referenced or name in referenced:
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime < cutoff:
+            yield name, stat.st_size
@@ -0,0 +1,67 @@
+# Generated by Django 5.2 on 2026-10-18 19:12
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_shopping_list_items(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+
+    recipe_amounts = defaultdict(list)
+    for recipe_id, ingredient_id, amount in RecipeIngredient.objects.filter(
+        recipe_id__in=ShoppingCart.objects.values('recipe_id')
+    ).values_list('recipe_id', 'ingredient_id', 'amount').iterator():
+        recipe_amounts[recipe_id].append((ingredient_id, amount))
+
+    totals = defaultdict(int)
+    for user_id, recipe_id in ShoppingCart.objects.values_list(
+        'user_id', 'recipe_id'
+    ).iterator():
+        for ingredient_id, amount in recipe_amounts[recipe_id]:
+            totals[user_id, ingredient_id] += amount
+
+    ShoppingListItem.objects.bulk_create(
+        (
+            ShoppingListItem(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total_amount
+            )
+            for (user_id, ingredient_id), total_amount in totals.items()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = (
+        ('recipes', '0005_recipe_recipe_name_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    )
+
+    operations = (
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Продукт в списке покупок',
+                'verbose_name_plural': 'Продукты в списках покупок',
+                'default_related_name': 'shopping_list_items',
+                'constraints': [models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_user_ingredient_shopping_list')],
+            },
+        ),
+        migrations.RunPython(
+            fill_shopping_list_items, migrations.RunPython.noop
+        ),
+    )
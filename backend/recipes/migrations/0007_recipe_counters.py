@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-18 20:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(related_model, fk_field):
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{fk_field: OuterRef('pk')}
+        ).order_by().values(fk_field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FavoriteRecipes = apps.get_model('recipes', 'FavoriteRecipes')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    Recipe.objects.update(
+        favorites_count=count_related(FavoriteRecipes, 'recipe'),
+        shopping_carts_count=count_related(ShoppingCart, 'recipe')
+    )
+    CustomUser.objects.update(
+        recipes_count=count_related(Recipe, 'author')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = (
+        ('recipes', '0006_shoppinglistitem'),
+        ('users', '0003_customuser_counters'),
+    )
+
+    operations = (
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    )
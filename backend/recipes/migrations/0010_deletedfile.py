@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = (
+        ('recipes', '0009_recipeneighbor'),
+    )
+
+    operations = (
+        migrations.CreateModel(
+            name='DeletedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Файл')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Удалён')),
+            ],
+            options={
+                'verbose_name': 'Удалённый файл',
+                'verbose_name_plural': 'Удалённые файлы',
+                'ordering': ('deleted_at',),
+            },
+        ),
+    )
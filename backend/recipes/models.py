@@ -1,7 +1,18 @@
-from django.db import models
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField,
+                                            TrigramSimilarity)
+from django.db import connections, models, transaction
+from django.db.models import (Case, Exists, F, OuterRef, Prefetch, Q, Sum,
+                              Value, When, Window)
+from django.db.models.functions import RowNumber
 from django.core.validators import MinValueValidator
 from django.contrib.auth import get_user_model
 
+from users.models import DenormalizedCountersMixin, Subscriptions
 from . import constants
 
 
@@ -34,7 +45,83 @@ class Ingredient(models.Model):
         return f"{self.name}, {self.measurement_unit}"
 
 
-class Recipe(models.Model):
+def recipe_search_vector():
+    return (
+        SearchVector(
+            'name', weight='A', config=settings.RECIPE_SEARCH_CONFIG
+        )
+        + SearchVector(
+            'text', weight='B', config=settings.RECIPE_SEARCH_CONFIG
+        )
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                is_author_subscribed=Value(False)
+            )
+        return self.annotate(
+            is_favorited=Exists(FavoriteRecipes.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_author_subscribed=Exists(Subscriptions.objects.filter(
+                user=user, subscribe=OuterRef('author')
+            ))
+        )
+
+    def search(self, query, ranked=True):
+        query = query.strip()
+        if not query:
+            return self
+        if connections[self.db].vendor != 'postgresql':
+            return self.filter(
+                Q(name__icontains=query) | Q(text__icontains=query)
+            )
+        search_query = SearchQuery(
+            query,
+            config=settings.RECIPE_SEARCH_CONFIG,
+            search_type='websearch'
+        )
+        queryset = self.filter(
+            Q(search_vector=search_query) | Q(name__trigram_similar=query)
+        )
+        if not ranked:
+            return queryset
+        return queryset.annotate(
+            search_rank=(
+                SearchRank(F('search_vector'), search_query)
+                + TrigramSimilarity('name', query)
+            )
+        ).order_by('-search_rank', 'name', 'id')
+
+    def limited_per_author(self, limit):
+        return self.annotate(
+            author_row_number=Window(
+                RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('name').asc(), F('id').asc())
+            )
+        ).filter(author_row_number__lte=limit)
+
+    def with_payload_data(self):
+        return self.select_related('author').prefetch_related(
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ).order_by('id')
+            )
+        )
+
+
+class Recipe(DenormalizedCountersMixin, models.Model):
     name = models.CharField(
         max_length=constants.RECIPE_NAME_MAX_LENGTH,
         verbose_name='Название рецепта'
@@ -58,11 +145,42 @@ class Recipe(models.Model):
         verbose_name='Автор рецепта',
         related_name='recipes'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    shopping_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ('favorites_count', 'shopping_carts_count')
 
     class Meta:
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipes'
         ordering = ['name']
+        # On other backends than PostgreSQL the GIN indexes are created as
+        # plain ones; search falls back to icontains there anyway.
+        indexes = (
+            models.Index(fields=['name', 'id'], name='recipe_name_id_idx'),
+            GinIndex(
+                fields=['search_vector'], name='recipe_search_vector_idx'
+            ),
+            GinIndex(
+                fields=['name'],
+                name='recipe_name_trgm_idx',
+                opclasses=['gin_trgm_ops']
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -150,3 +268,216 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user.username} -> {self.recipe.name}'
+
+
+class ShoppingListItemManager(models.Manager):
+    def apply_deltas(self, user_ids, deltas):
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        user_ids = list(user_ids)
+        if not user_ids or not deltas:
+            return
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(
+                pk__in=user_ids
+            ).order_by('pk').values_list('pk', flat=True))
+            items = self.filter(
+                user_id__in=user_ids,
+                ingredient_id__in=deltas
+            )
+            items.update(total_amount=F('total_amount') + Case(
+                *[
+                    When(ingredient_id=ingredient_id, then=Value(delta))
+                    for ingredient_id, delta in deltas.items()
+                ],
+                default=Value(0)
+            ))
+            existing = set(items.values_list('user_id', 'ingredient_id'))
+            self.bulk_create(
+                self.model(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=delta
+                )
+                for user_id in user_ids
+                for ingredient_id, delta in deltas.items()
+                if delta > 0 and (user_id, ingredient_id) not in existing
+            )
+            self.filter(
+                user_id__in=user_ids,
+                total_amount__lte=0
+            ).delete()
+
+    def change_recipes(self, user_id, added=(), removed=()):
+        added, removed = set(added), set(removed)
+        deltas = defaultdict(int)
+        rows = RecipeIngredient.objects.filter(
+            recipe_id__in=added | removed
+        ).values_list('recipe_id', 'ingredient_id', 'amount')
+        for recipe_id, ingredient_id, amount in rows:
+            deltas[ingredient_id] += amount if recipe_id in added else -amount
+        self.apply_deltas([user_id], deltas)
+
+    def compute_totals(self, user_ids=None):
+        if user_ids is None:
+            carts = {'recipe__shopping_carts__isnull': False}
+        else:
+            carts = {'recipe__shopping_carts__user__in': user_ids}
+        return {
+            (item['recipe__shopping_carts__user'], item['ingredient']):
+                item['total_amount']
+            for item in RecipeIngredient.objects.filter(**carts).values(
+                'recipe__shopping_carts__user', 'ingredient'
+            ).annotate(
+                total_amount=Sum('amount')
+            ).order_by()
+        }
+
+    def rebuild(self, user_ids=None):
+        totals = self.compute_totals(user_ids)
+        with transaction.atomic():
+            items = self.all()
+            if user_ids is not None:
+                items = items.filter(user_id__in=user_ids)
+            items.delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total_amount
+                    )
+                    for (user_id, ingredient_id), total_amount
+                    in totals.items()
+                ),
+                batch_size=1000
+            )
+        return len(totals)
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.IntegerField(
+        verbose_name='Количество'
+    )
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Продукт в списке покупок'
+        verbose_name_plural = 'Продукты в списках покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name="unique_user_ingredient_shopping_list"
+            ),
+        )
+        default_related_name = 'shopping_list_items'
+
+    def __str__(self):
+        return f'{self.user.username}: {self.ingredient} x {self.total_amount}'
+
+
+class RecipeNeighbor(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='neighbors',
+        verbose_name='Рецепт'
+    )
+    neighbor = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='neighbor_of',
+        verbose_name='Похожий рецепт'
+    )
+    rank = models.PositiveSmallIntegerField(
+        verbose_name='Позиция'
+    )
+    score = models.FloatField(
+        verbose_name='Сходство'
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        ordering = ('recipe', 'rank')
+        constraints = (
+            models.UniqueConstraint(
+                fields=['recipe', 'rank'],
+                name='unique_recipe_neighbor_rank'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} -> {self.neighbor} ({self.score:.3f})'
+
+
+class ShoppingListExport(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Формируется'
+        READY = 'ready', 'Готов'
+        FAILED = 'failed', 'Ошибка'
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_exports',
+        verbose_name='Пользователь'
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name='Статус'
+    )
+    file = models.FileField(
+        upload_to='shopping_lists/',
+        blank=True,
+        verbose_name='Файл'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Создан'
+    )
+
+    class Meta:
+        verbose_name = 'Выгрузка списка покупок'
+        verbose_name_plural = 'Выгрузки списков покупок'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.user.username}: {self.get_status_display()}'
+
+
+class DeletedFile(models.Model):
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Файл'
+    )
+    deleted_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Удалён'
+    )
+
+    class Meta:
+        verbose_name = 'Удалённый файл'
+        verbose_name_plural = 'Удалённые файлы'
+        ordering = ('deleted_at',)
+
+    def __str__(self):
+        return self.name
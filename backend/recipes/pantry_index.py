@@ -0,0 +1,144 @@
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from threading import Lock
+from time import time_ns
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import RecipeIngredient
+
+INDEX_VERSION_KEY = 'pantry-index-version'
+INDEX_CHANGE_TIMEOUT = 60 * 60 * 24
+INDEX_MAX_CHANGES = 500
+ITERATOR_CHUNK_SIZE = 5000
+
+
+def index_change_key(version):
+    return f'pantry-index-change:{version}'
+
+
+def get_index_version():
+    version = cache.get(INDEX_VERSION_KEY)
+    if version is None:
+        # A counter lost to eviction or a cache restart starts again from the
+        # current time, so it never repeats a version a process has already
+        # seen and every process rebuilds instead of keeping a stale index.
+        cache.add(INDEX_VERSION_KEY, time_ns(), None)
+        version = cache.get(INDEX_VERSION_KEY)
+    return version
+
+
+def publish_recipe_changes(recipe_ids):
+    get_index_version()
+    version = cache.incr(INDEX_VERSION_KEY)
+    cache.set(index_change_key(version), recipe_ids, INDEX_CHANGE_TIMEOUT)
+
+
+def invalidate_index():
+    # Jumping past INDEX_MAX_CHANGES makes every process rebuild from scratch,
+    # for bulk loads that would not fit into the change log.
+    get_index_version()
+    cache.incr(INDEX_VERSION_KEY, INDEX_MAX_CHANGES + 1)
+
+
+def mark_recipes_changed(recipe_ids):
+    # Other processes reload the recipes from the database, so the change is
+    # published only once it is visible there.
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: publish_recipe_changes(recipe_ids))
+
+
+class PantryIndex:
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.postings = {}
+        self.recipes = {}
+
+    def load(self, recipe_ids=None):
+        rows = RecipeIngredient.objects.order_by(
+            'recipe_id', 'ingredient_id'
+        ).values_list('recipe_id', 'ingredient_id')
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        recipes = defaultdict(lambda: array('l'))
+        for recipe_id, ingredient_id in rows.iterator(
+            chunk_size=ITERATOR_CHUNK_SIZE
+        ):
+            recipes[recipe_id].append(ingredient_id)
+        return recipes
+
+    def rebuild(self, version):
+        recipes = self.load()
+        postings = defaultdict(lambda: array('l'))
+        for recipe_id, ingredient_ids in recipes.items():
+            for ingredient_id in ingredient_ids:
+                postings[ingredient_id].append(recipe_id)
+        self.postings = dict(postings)
+        self.recipes = dict(recipes)
+        self.version = version
+
+    def remove_recipe(self, recipe_id):
+        for ingredient_id in self.recipes.pop(recipe_id, ()):
+            posting = self.postings[ingredient_id]
+            del posting[bisect_left(posting, recipe_id)]
+            if not posting:
+                del self.postings[ingredient_id]
+
+    def add_recipe(self, recipe_id, ingredient_ids):
+        self.recipes[recipe_id] = ingredient_ids
+        for ingredient_id in ingredient_ids:
+            insort(
+                self.postings.setdefault(ingredient_id, array('l')),
+                recipe_id
+            )
+
+    def apply_changes(self, version, recipe_ids):
+        recipes = self.load(recipe_ids)
+        for recipe_id in recipe_ids:
+            self.remove_recipe(recipe_id)
+            if recipe_id in recipes:
+                self.add_recipe(recipe_id, recipes[recipe_id])
+        self.version = version
+
+    def refresh(self):
+        version = get_index_version()
+        if self.version == version:
+            return
+        if self.version is None or not (
+            0 < version - self.version <= INDEX_MAX_CHANGES
+        ):
+            self.rebuild(version)
+            return
+        keys = [
+            index_change_key(number)
+            for number in range(self.version + 1, version + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            self.rebuild(version)
+            return
+        self.apply_changes(version, {
+            recipe_id
+            for recipe_ids in changes.values()
+            for recipe_id in recipe_ids
+        })
+
+    def search(self, ingredient_ids, max_missing=0):
+        with self.lock:
+            self.refresh()
+            matched = Counter()
+            for ingredient_id in set(ingredient_ids):
+                matched.update(self.postings.get(ingredient_id, ()))
+            results = []
+            for recipe_id, count in matched.items():
+                total = len(self.recipes[recipe_id])
+                if total - count <= max_missing:
+                    results.append((recipe_id, total - count, count / total))
+        results.sort(key=lambda item: (-item[2], item[1], item[0]))
+        return [(recipe_id, missing) for recipe_id, missing, _ in results]
+
+
+pantry_index = PantryIndex()
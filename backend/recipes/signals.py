@@ -0,0 +1,258 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from users.signals import bulk_counters
+
+from .media import (
+    forget_deleted_files,
+    loaded_file_names,
+    record_deleted_files,
+    remember_file_names,
+    replaced_file_names,
+)
+from .models import (
+    FavoriteRecipes,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListExport,
+    ShoppingListItem,
+    recipe_search_vector,
+)
+
+User = get_user_model()
+
+
+def change_counter(model, pk, field, delta):
+    if bulk_counters.get():
+        return
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def increase_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+def search_text(instance):
+    # Raw values, so that deferred fields are not fetched.
+    return instance.__dict__.get('name'), instance.__dict__.get('text')
+
+
+@receiver(post_init, sender=Recipe)
+def remember_search_text(sender, instance, **kwargs):
+    instance._stored_search_text = search_text(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_vector(sender, instance, created, using, update_fields,
+                         **kwargs):
+    if connections[using].vendor != 'postgresql':
+        return
+    if update_fields is not None and not {'name', 'text'} & update_fields:
+        return
+    if not created and search_text(instance) == getattr(
+        instance, '_stored_search_text', None
+    ):
+        return
+    Recipe.objects.using(using).filter(pk=instance.pk).update(
+        search_vector=recipe_search_vector()
+    )
+    remember_search_text(sender, instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrease_recipes_count(sender, instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=FavoriteRecipes)
+def increase_favorites_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipes)
+def decrease_favorites_count(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def increase_shopping_carts_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'shopping_carts_count', 1)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def decrease_shopping_carts_count(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'shopping_carts_count', -1)
+
+
+class ShoppingListRemoval:
+    # What one deletion takes out of the shopping lists. Every cart row
+    # contributes each ingredient row of its recipe once; deleting a recipe
+    # or a user removes both sides of such a pair, so pairs are tracked to
+    # subtract each contribution only once.
+    def __init__(self):
+        self.ingredients = {}
+        self.carts = {}
+        self.removed = set()
+        self.deltas = defaultdict(lambda: defaultdict(int))
+
+    def recipe_ingredients(self, recipe_id):
+        if recipe_id not in self.ingredients:
+            self.ingredients[recipe_id] = list(
+                RecipeIngredient.objects.filter(
+                    recipe_id=recipe_id
+                ).values_list('pk', 'ingredient_id', 'amount')
+            )
+        return self.ingredients[recipe_id]
+
+    def recipe_carts(self, recipe_id):
+        if recipe_id not in self.carts:
+            self.carts[recipe_id] = list(ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('pk', 'user_id'))
+        return self.carts[recipe_id]
+
+    def remove(self, cart_id, user_id, item_id, ingredient_id, amount):
+        if (cart_id, item_id) in self.removed:
+            return
+        self.removed.add((cart_id, item_id))
+        self.deltas[user_id][ingredient_id] -= amount
+
+    def remove_cart(self, cart):
+        for item_id, ingredient_id, amount in self.recipe_ingredients(
+            cart.recipe_id
+        ):
+            self.remove(cart.pk, cart.user_id, item_id, ingredient_id, amount)
+
+    def remove_item(self, item):
+        for cart_id, user_id in self.recipe_carts(item.recipe_id):
+            self.remove(
+                cart_id, user_id, item.pk, item.ingredient_id, item.amount
+            )
+
+    def apply(self):
+        users = defaultdict(list)
+        for user_id, deltas in self.deltas.items():
+            users[frozenset(deltas.items())].append(user_id)
+        for deltas, user_ids in users.items():
+            ShoppingListItem.objects.apply_deltas(user_ids, dict(deltas))
+
+
+def collect_shopping_list_removal(origin, collect):
+    # All pre_delete signals of a deletion are sent before any row is
+    # deleted, and they share the origin, so the removal is collected there
+    # and applied on the first post_delete.
+    removal = getattr(origin, '_shopping_list_removal', None)
+    if removal is None:
+        removal = ShoppingListRemoval()
+        if origin is not None:
+            origin._shopping_list_removal = removal
+    collect(removal)
+    if origin is None:
+        removal.apply()
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def collect_removed_cart(sender, instance, origin=None, **kwargs):
+    if not bulk_counters.get():
+        collect_shopping_list_removal(
+            origin, lambda removal: removal.remove_cart(instance)
+        )
+
+
+@receiver(pre_delete, sender=RecipeIngredient)
+def collect_removed_recipe_ingredient(sender, instance, origin=None,
+                                      **kwargs):
+    if not bulk_counters.get():
+        collect_shopping_list_removal(
+            origin, lambda removal: removal.remove_item(instance)
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=RecipeIngredient)
+def apply_removed_shopping_list_items(sender, origin=None, **kwargs):
+    removal = getattr(origin, '_shopping_list_removal', None)
+    if removal is not None:
+        del origin._shopping_list_removal
+        removal.apply()
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_cart_to_shopping_list(sender, instance, created, **kwargs):
+    if created and not bulk_counters.get():
+        ShoppingListItem.objects.change_recipes(
+            instance.user_id, added=[instance.recipe_id]
+        )
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(sender, instance, raw=False, **kwargs):
+    # Covers single saves such as admin inlines; the API writes ingredients
+    # in bulk and applies the deltas itself.
+    instance._stored_amount = None
+    if not raw and not instance._state.adding:
+        instance._stored_amount = RecipeIngredient.objects.filter(
+            pk=instance.pk
+        ).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_shopping_lists(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = defaultdict(int)
+    deltas[instance.ingredient_id] += instance.amount
+    if instance._stored_amount is not None:
+        ingredient_id, amount = instance._stored_amount
+        deltas[ingredient_id] -= amount
+    if any(deltas.values()):
+        ShoppingListItem.objects.apply_deltas(
+            ShoppingCart.objects.filter(
+                recipe_id=instance.recipe_id
+            ).values_list('user_id', flat=True),
+            deltas
+        )
+
+
+@receiver(post_init, sender=Recipe)
+@receiver(post_init, sender=User)
+@receiver(post_init, sender=ShoppingListExport)
+def remember_files(sender, instance, **kwargs):
+    remember_file_names(instance)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=ShoppingListExport)
+def record_replaced_files(sender, instance, created, update_fields,
+                          **kwargs):
+    replaced = {} if created else replaced_file_names(instance, update_fields)
+    if replaced:
+        record_deleted_files(old for old, _ in replaced.values())
+        forget_deleted_files(new for _, new in replaced.values())
+    remember_file_names(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=ShoppingListExport)
+def record_removed_files(sender, instance, **kwargs):
+    record_deleted_files(loaded_file_names(instance).values())
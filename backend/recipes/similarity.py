@@ -0,0 +1,112 @@
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from .models import RecipeIngredient, RecipeNeighbor
+
+METRICS = ('cosine', 'jaccard')
+CHUNK_SIZE = 128
+BATCH_SIZE = 5000
+ITERATOR_CHUNK_SIZE = 5000
+
+
+def load_matrix(weighted=False):
+    rows = np.array(
+        list(RecipeIngredient.objects.order_by().values_list(
+            'recipe_id', 'ingredient_id', 'amount'
+        ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)),
+        dtype=np.int64
+    ).reshape(-1, 3)
+    recipe_ids, recipe_index = np.unique(rows[:, 0], return_inverse=True)
+    ingredient_ids, ingredient_index = np.unique(
+        rows[:, 1], return_inverse=True
+    )
+    if weighted:
+        # Amounts are in different units, so large numbers of grams would
+        # outweigh everything else without the log.
+        values = np.log1p(rows[:, 2]).astype(np.float32)
+    else:
+        values = np.ones(len(rows), dtype=np.float32)
+    matrix = sparse.csr_matrix(
+        (values, (recipe_index, ingredient_index)),
+        shape=(len(recipe_ids), len(ingredient_ids))
+    )
+    return recipe_ids, matrix
+
+
+def cosine_scores(matrix):
+    norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+    normalized = sparse.diags((1 / norms).astype(np.float32)) @ matrix
+    transposed = normalized.T.tocsr()
+
+    def scores(rows):
+        return (normalized[rows] @ transposed).toarray()
+    return scores
+
+
+def jaccard_scores(matrix):
+    matrix = (matrix > 0).astype(np.float32)
+    sizes = matrix.sum(axis=1).A1
+    transposed = matrix.T.tocsr()
+
+    def scores(rows):
+        common = (matrix[rows] @ transposed).toarray()
+        return common / (sizes[rows, None] + sizes[None, :] - common)
+    return scores
+
+
+def compute_neighbors(top_k, metric='cosine', weighted=False,
+                      recipe_ids=None):
+    all_ids, matrix = load_matrix(weighted)
+    count = len(all_ids)
+    top_k = min(top_k, count - 1)
+    if top_k <= 0:
+        return
+    scores = (cosine_scores if metric == 'cosine' else jaccard_scores)(
+        matrix
+    )
+    rows = np.arange(count)
+    if recipe_ids is not None:
+        rows = rows[np.isin(all_ids, list(recipe_ids))]
+
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[start:start + CHUNK_SIZE]
+        chunk_scores = scores(chunk)
+        chunk_scores[np.arange(len(chunk)), chunk] = 0
+        top = np.argpartition(-chunk_scores, top_k - 1, axis=1)[:, :top_k]
+        top_scores = np.take_along_axis(chunk_scores, top, axis=1)
+        order = np.lexsort((all_ids[top], -top_scores), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        for row, neighbors, neighbor_scores in zip(chunk, top, top_scores):
+            yield all_ids[row].item(), [
+                (all_ids[neighbor].item(), score.item())
+                for neighbor, score in zip(neighbors, neighbor_scores)
+                if score > 0
+            ]
+
+
+def store_neighbors(results, recipe_ids=None):
+    with transaction.atomic():
+        stale = RecipeNeighbor.objects.all()
+        if recipe_ids is not None:
+            stale = stale.filter(recipe_id__in=recipe_ids)
+        stale.delete()
+        batch = []
+        stored = 0
+        for recipe_id, neighbors in results:
+            batch.extend(
+                RecipeNeighbor(
+                    recipe_id=recipe_id,
+                    neighbor_id=neighbor_id,
+                    rank=rank,
+                    score=score
+                )
+                for rank, (neighbor_id, score) in enumerate(neighbors, 1)
+            )
+            if len(batch) >= BATCH_SIZE:
+                RecipeNeighbor.objects.bulk_create(batch)
+                stored += len(batch)
+                batch = []
+        RecipeNeighbor.objects.bulk_create(batch)
+        return stored + len(batch)
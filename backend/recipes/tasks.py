@@ -0,0 +1,63 @@
+from datetime import timedelta
+from uuid import uuid4
+
+from api.cache import invalidate_recipe_payloads
+from api.shopping_list import render_pdf
+from django.core.files import File
+from django.core.management import call_command
+from django.db.models import Q
+from django.utils import timezone
+from tasks.registry import task
+
+from .images import store_variants
+from .models import Recipe, ShoppingListExport
+
+SHOPPING_LIST_EXPORT_TTL = timedelta(days=1)
+
+
+@task(max_attempts=5, retry_delay=30)
+def render_image_variants(name, sizes):
+    store_variants(name, sizes)
+    # Payloads cached before the variants existed point at the original.
+    invalidate_recipe_payloads(
+        Recipe.objects.filter(
+            Q(image=name) | Q(author__avatar=name)
+        ).values_list('id', flat=True)
+    )
+
+
+@task(max_attempts=1, every=timedelta(days=1))
+def reconcile_counters():
+    call_command('reconcile_counters')
+
+
+@task(max_attempts=1, every=timedelta(hours=1))
+def reclaim_media():
+    call_command('reclaim_media')
+
+
+@task(max_attempts=1)
+def render_shopping_list_pdf(export_id):
+    export = ShoppingListExport.objects.select_related('user').filter(
+        pk=export_id
+    ).first()
+    if export is None:
+        return
+    try:
+        with render_pdf(export.user) as output:
+            export.file.save(f'{uuid4().hex}.pdf', File(output), save=False)
+    except Exception:
+        ShoppingListExport.objects.filter(pk=export_id).update(
+            status=ShoppingListExport.Status.FAILED
+        )
+        raise
+    export.status = ShoppingListExport.Status.READY
+    export.save(update_fields=['file', 'status'])
+
+
+@task(max_attempts=1, every=timedelta(hours=1))
+def purge_shopping_list_exports():
+    # The files are removed by reclaim_media through the usual tombstones.
+    ShoppingListExport.objects.filter(
+        created_at__lt=timezone.now() - SHOPPING_LIST_EXPORT_TTL
+    ).delete()
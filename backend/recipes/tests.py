@@ -0,0 +1,601 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import skipUnless
+
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+from users.models import Subscriptions
+
+from .images import (
+    RECIPE_IMAGE_SIZES,
+    all_variant_names,
+    store_image,
+    store_variants,
+)
+from .ingredient_index import IngredientPrefixIndex
+from .management.commands.reconcile_counters import COUNTERS, count_related
+from .media import reclaim_deleted_files
+from .models import (
+    DeletedFile,
+    FavoriteRecipes,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+)
+from .pantry_index import (
+    INDEX_VERSION_KEY,
+    PantryIndex,
+    publish_recipe_changes,
+)
+from .similarity import compute_neighbors
+
+User = get_user_model()
+
+
+def create_user(username):
+    return User.objects.create_user(
+        email=f'{username}@example.com',
+        username=username,
+        password='password',
+        first_name=username,
+        last_name=username
+    )
+
+
+def create_recipe(author, name, ingredients=()):
+    recipe = Recipe.objects.create(
+        author=author,
+        name=name,
+        text=f'{name} text',
+        cooking_time=10,
+        image='recipes/test.jpg'
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=amount)
+        for ingredient, amount in ingredients
+    )
+    return recipe
+
+
+class ShoppingListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = create_user('author')
+        self.user = create_user('user')
+        self.jam = Ingredient.objects.create(
+            name='абрикосовое варенье', measurement_unit='zz'
+        )
+        self.sugar = Ingredient.objects.create(
+            name='сахар', measurement_unit='г'
+        )
+        self.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        self.pie = create_recipe(
+            self.author, 'Пирог', [(self.jam, 10), (self.sugar, 100)]
+        )
+        self.buns = create_recipe(
+            self.author, 'Булочки', [(self.sugar, 50), (self.flour, 300)]
+        )
+
+    def stored(self):
+        return {
+            (item.user_id, item.ingredient_id): item.total_amount
+            for item in ShoppingListItem.objects.all()
+        }
+
+    def assertInSync(self, expected=None):
+        stored = self.stored()
+        self.assertEqual(stored, ShoppingListItem.objects.compute_totals())
+        if expected is not None:
+            self.assertEqual(stored, expected)
+
+    def test_adding_and_removing_carts(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pie)
+        cart = ShoppingCart.objects.create(user=self.user, recipe=self.buns)
+        self.assertInSync({
+            (self.user.pk, self.jam.pk): 10,
+            (self.user.pk, self.sugar.pk): 150,
+            (self.user.pk, self.flour.pk): 300,
+        })
+        cart.delete()
+        self.assertInSync({
+            (self.user.pk, self.jam.pk): 10,
+            (self.user.pk, self.sugar.pk): 100,
+        })
+        ShoppingCart.objects.filter(user=self.user).delete()
+        self.assertInSync({})
+
+    def test_recipe_delete_outside_the_api(self):
+        for user in (self.user, self.author):
+            ShoppingCart.objects.create(user=user, recipe=self.pie)
+            ShoppingCart.objects.create(user=user, recipe=self.buns)
+        self.pie.delete()
+        self.assertInSync({
+            (user.pk, ingredient.pk): amount
+            for user in (self.user, self.author)
+            for ingredient, amount in ((self.sugar, 50), (self.flour, 300))
+        })
+        Recipe.objects.all().delete()
+        self.assertInSync({})
+
+    def test_user_delete_cascades_to_other_lists(self):
+        ShoppingCart.objects.create(user=self.author, recipe=self.pie)
+        ShoppingCart.objects.create(user=self.user, recipe=self.pie)
+        other = create_recipe(create_user('other'), 'Каша', [(self.flour, 5)])
+        ShoppingCart.objects.create(user=self.user, recipe=other)
+        self.author.delete()
+        self.assertInSync({(self.user.pk, self.flour.pk): 5})
+
+    def test_recipe_ingredient_changes(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pie)
+        self.pie.recipe_ingredients.get(ingredient=self.jam).delete()
+        self.assertInSync({(self.user.pk, self.sugar.pk): 100})
+
+        item = self.pie.recipe_ingredients.get(ingredient=self.sugar)
+        item.amount = 30
+        item.save()
+        RecipeIngredient.objects.create(
+            recipe=self.pie, ingredient=self.flour, amount=7
+        )
+        self.assertInSync({
+            (self.user.pk, self.sugar.pk): 30,
+            (self.user.pk, self.flour.pk): 7,
+        })
+
+        item.ingredient = self.jam
+        item.save()
+        self.assertInSync({
+            (self.user.pk, self.jam.pk): 30,
+            (self.user.pk, self.flour.pk): 7,
+        })
+
+    def test_ingredient_delete(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pie)
+        self.sugar.delete()
+        self.assertInSync({(self.user.pk, self.jam.pk): 10})
+
+    def test_api_changes(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        author_client = APIClient()
+        author_client.force_authenticate(self.author)
+
+        client.post(f'/api/recipes/{self.pie.pk}/shopping_cart/')
+        client.post('/api/recipes/shopping_cart/bulk/', {
+            'add': [self.buns.pk]
+        }, format='json')
+        self.assertInSync()
+        response = author_client.patch(f'/api/recipes/{self.pie.pk}/', {
+            'ingredients': [
+                {'id': self.sugar.pk, 'amount': 20},
+                {'id': self.flour.pk, 'amount': 1},
+            ]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertInSync({
+            (self.user.pk, self.sugar.pk): 70,
+            (self.user.pk, self.flour.pk): 301,
+        })
+        client.delete(f'/api/recipes/{self.buns.pk}/shopping_cart/')
+        self.assertInSync({
+            (self.user.pk, self.sugar.pk): 20,
+            (self.user.pk, self.flour.pk): 1,
+        })
+        author_client.delete(f'/api/recipes/{self.pie.pk}/')
+        self.assertInSync({})
+
+    def test_download_after_recipe_delete(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.post(f'/api/recipes/{self.pie.pk}/shopping_cart/')
+        self.pie.delete()
+        response = client.get(
+            '/api/recipes/download_shopping_cart/?format=txt'
+        )
+        content = b''.join(response.streaming_content).decode()
+        self.assertNotIn('Абрикосовое варенье', content)
+
+
+class RecipeAdminSearchTests(TestCase):
+    def test_author_substring_and_recipe_name(self):
+        author = create_user('VasilyPupkin')
+        soup = create_recipe(author, 'Грибной суп')
+        other = create_recipe(create_user('someone'), 'Окрошка')
+        model_admin = site._registry[Recipe]
+        request = RequestFactory().get('/admin/recipes/recipe/')
+        for term, expected in (
+            ('pupkin', [soup]),
+            ('  Vasily ', [soup]),
+            ('Окрош', [other]),
+            ('нет такого', []),
+        ):
+            queryset, _ = model_admin.get_search_results(
+                request, Recipe.objects.all(), term
+            )
+            self.assertEqual(list(queryset), expected, term)
+
+
+class PantryIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = create_user('author')
+        self.salt = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        self.index = PantryIndex()
+
+    def test_lost_version_counter_does_not_reuse_versions(self):
+        soup = create_recipe(self.author, 'Суп', [(self.salt, 5)])
+        publish_recipe_changes([soup.pk])
+        self.assertEqual(self.index.search([self.salt.pk]), [(soup.pk, 0)])
+
+        cache.delete(INDEX_VERSION_KEY)
+        porridge = create_recipe(self.author, 'Каша', [(self.salt, 1)])
+        publish_recipe_changes([porridge.pk])
+        self.assertEqual(
+            sorted(self.index.search([self.salt.pk])),
+            [(soup.pk, 0), (porridge.pk, 0)]
+        )
+
+
+class LoadIngredientsTests(TestCase):
+    def test_updates_reach_cached_payloads_and_search(self):
+        cache.clear()
+        user = create_user('user')
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        recipe = create_recipe(user, 'Суп', [(salt, 5)])
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f'/api/recipes/{recipe.pk}/'
+        self.assertEqual(
+            client.get(url).data['ingredients'][0]['measurement_unit'], 'г'
+        )
+        client.get('/api/ingredients/?name=пер')
+
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', encoding='utf-8'
+        ) as file:
+            file.write('соль,щепотка\nперец,г\n')
+            file.flush()
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command(
+                    'load_ingredients', file.name, stdout=StringIO()
+                )
+
+        self.assertEqual(
+            client.get(url).data['ingredients'][0]['measurement_unit'],
+            'щепотка'
+        )
+        self.assertEqual(
+            [item['name'] for item in client.get(
+                '/api/ingredients/?name=пер'
+            ).data],
+            ['перец']
+        )
+
+
+class RecipeSearchTests(TestCase):
+    def setUp(self):
+        self.author = create_user('author')
+
+    def create_recipe(self, name, text):
+        return Recipe.objects.create(
+            author=self.author, name=name, text=text, cooking_time=10
+        )
+
+    def test_matches_name_and_text(self):
+        # SQLite folds the case of ASCII letters only.
+        soup = self.create_recipe('Грибной суп', 'Сварить')
+        pie = self.create_recipe('Пирог', 'Подать с грибным супом')
+        self.create_recipe('Каша', 'Сварить')
+        self.assertEqual(
+            set(Recipe.objects.search('суп')), {soup, pie}
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'Postgres search')
+    def test_name_matches_rank_first(self):
+        in_text = self.create_recipe('Обед', 'Борщ и котлеты')
+        in_name = self.create_recipe('Борщ', 'Сварить')
+        self.assertEqual(
+            list(Recipe.objects.search('борщ')), [in_name, in_text]
+        )
+        response = APIClient().get('/api/recipes/?search=борщ')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [in_name.pk, in_text.pk]
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'Postgres search')
+    def test_vector_is_updated_only_when_the_text_changes(self):
+        recipe = self.create_recipe('Борщ', 'Сварить')
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        recipe.cooking_time = 20
+        with CaptureQueriesContext(connection) as queries:
+            recipe.save()
+        self.assertEqual(len(queries), 1)
+        recipe.name = 'Щи'
+        recipe.save()
+        self.assertEqual(list(Recipe.objects.search('щи')), [recipe])
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.author = create_user('author')
+        self.users = [create_user('user1'), create_user('user2')]
+        self.recipes = [
+            create_recipe(self.author, name) for name in ('Суп', 'Каша')
+        ]
+
+    def assertCountersInSync(self):
+        for model, field, related_model, fk_field in COUNTERS:
+            rows = model.objects.annotate(
+                actual=count_related(related_model, fk_field)
+            ).values_list(field, 'actual')
+            for stored, actual in rows:
+                self.assertEqual(stored, actual, f'{model.__name__}.{field}')
+
+    def test_orm_changes_keep_counters_in_sync(self):
+        for user in self.users:
+            for recipe in self.recipes:
+                FavoriteRecipes.objects.create(user=user, recipe=recipe)
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+            Subscriptions.objects.create(user=user, subscribe=self.author)
+        Subscriptions.objects.create(
+            user=self.author, subscribe=self.users[0]
+        )
+        self.assertCountersInSync()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (self.author.recipes_count, self.author.subscribers_count),
+            (2, 2)
+        )
+
+        FavoriteRecipes.objects.filter(user=self.users[0]).delete()
+        ShoppingCart.objects.get(
+            user=self.users[1], recipe=self.recipes[0]
+        ).delete()
+        self.recipes[1].delete()
+        self.assertCountersInSync()
+        self.users[1].delete()
+        self.assertCountersInSync()
+        self.assertEqual(
+            Recipe.objects.values_list(
+                'favorites_count', 'shopping_carts_count'
+            ).get(),
+            (0, 1)
+        )
+
+    def test_saving_a_stale_instance_keeps_counters(self):
+        stale = Recipe.objects.get(pk=self.recipes[0].pk)
+        stale_author = User.objects.get(pk=self.author.pk)
+        FavoriteRecipes.objects.create(user=self.users[0], recipe=stale)
+        Subscriptions.objects.create(
+            user=self.users[0], subscribe=self.author
+        )
+        stale.name = 'Суп дня'
+        stale.save()
+        stale_author.first_name = 'Автор'
+        stale_author.save()
+        self.assertCountersInSync()
+
+    def test_save_semantics_are_unchanged(self):
+        saves = []
+
+        def remember(sender, update_fields, created, **kwargs):
+            saves.append((created, update_fields))
+
+        post_save.connect(remember, sender=Recipe)
+        self.addCleanup(post_save.disconnect, remember, sender=Recipe)
+        recipe = Recipe.objects.get(pk=self.recipes[0].pk)
+        recipe.save()
+        Recipe.objects.filter(pk=recipe.pk).delete()
+        recipe.save()
+        self.assertEqual(saves, [(False, None), (True, None)])
+        self.assertCountersInSync()
+        recipe.favorites_count = 5
+        recipe.save(update_fields=['favorites_count'])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 5)
+
+    def test_reconcile_counters_fixes_drift(self):
+        FavoriteRecipes.objects.create(
+            user=self.users[0], recipe=self.recipes[0]
+        )
+        Recipe.objects.update(favorites_count=5)
+        User.objects.filter(pk=self.author.pk).update(recipes_count=0)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertCountersInSync()
+
+
+class IngredientIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.index = IngredientPrefixIndex()
+        for name in ('соль', 'Солод', 'фасоль', 'мёд', 'медовик', 'мука'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def names(self, prefix, limit=100):
+        return [
+            ingredient.name for ingredient in self.index.search(prefix, limit)
+        ]
+
+    def test_prefix_matching_ignores_case_and_yo(self):
+        self.assertEqual(self.names('сол'), ['Солод', 'соль'])
+        self.assertEqual(self.names('СОЛЬ'), ['соль'])
+        self.assertEqual(self.names('мед'), ['мёд', 'медовик'])
+        self.assertEqual(self.names('МЁД'), ['мёд', 'медовик'])
+        self.assertEqual(self.names('оль'), [])
+        self.assertEqual(len(self.names('')), 6)
+
+    @override_settings(INGREDIENTS_SEARCH_LIMIT=2)
+    def test_api_caps_results(self):
+        response = APIClient().get('/api/ingredients/?name=м')
+        self.assertEqual(
+            [item['name'] for item in response.data], ['мёд', 'медовик']
+        )
+        self.assertEqual(len(APIClient().get('/api/ingredients/').data), 2)
+
+    def test_rebuilds_after_the_commit(self):
+        self.assertEqual(self.names('пер'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='перец', measurement_unit='г')
+            self.assertEqual(self.names('пер'), [])
+        self.assertEqual(self.names('пер'), ['перец'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.filter(name='перец').delete()
+        self.assertEqual(self.names('пер'), [])
+
+
+class MediaReclaimTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.author = create_user('author')
+
+    def store(self, color='red'):
+        output = BytesIO()
+        Image.new('RGB', (40, 30), color).save(output, 'PNG')
+        return store_image(
+            File(output, 'image.png'), 'recipes/images/', RECIPE_IMAGE_SIZES
+        )
+
+    def create_recipe(self, image):
+        return Recipe.objects.create(
+            author=self.author,
+            name='Рецепт',
+            text='text',
+            cooking_time=10,
+            image=image
+        )
+
+    def reclaim(self):
+        return reclaim_deleted_files(min_age=timedelta(0))
+
+    def test_unused_files_are_reclaimed_with_variants(self):
+        name = self.store()
+        store_variants(name, RECIPE_IMAGE_SIZES)
+        self.create_recipe(name).delete()
+        self.assertEqual(self.reclaim(), (1, 0, 6))
+        for path in all_variant_names(name):
+            self.assertFalse(default_storage.exists(path))
+        self.assertFalse(DeletedFile.objects.exists())
+
+    def test_shared_and_fresh_files_are_kept(self):
+        name = self.store()
+        self.create_recipe(name)
+        self.create_recipe(name).delete()
+        self.assertEqual(self.reclaim(), (0, 1, 0))
+        self.assertTrue(default_storage.exists(name))
+        Recipe.objects.get().delete()
+        self.assertEqual(reclaim_deleted_files(), (0, 0, 0))
+        self.assertTrue(DeletedFile.objects.filter(name=name).exists())
+
+    def test_reupload_of_a_tombstoned_file(self):
+        name = self.store()
+        self.create_recipe(name).delete()
+        self.assertEqual(self.store(), name)
+        self.assertFalse(DeletedFile.objects.exists())
+        self.create_recipe(name).delete()
+        self.reclaim()
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(self.store(), name)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_sweep_tombstones_orphans_before_deleting_them(self):
+        used = self.store('red')
+        store_variants(used, RECIPE_IMAGE_SIZES)
+        self.create_recipe(used)
+        orphan = self.store('blue')
+        default_storage.save('recipes/images/stray.txt', BytesIO(b'stray'))
+        call_command(
+            'reclaim_media', '--sweep', '--min-age', '0', stdout=StringIO()
+        )
+        self.assertEqual(
+            set(DeletedFile.objects.values_list('name', flat=True)),
+            {orphan, 'recipes/images/stray.txt'}
+        )
+        self.assertTrue(default_storage.exists(orphan))
+        call_command('reclaim_media', '--min-age', '0', stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertFalse(default_storage.exists('recipes/images/stray.txt'))
+        for path in all_variant_names(used):
+            self.assertTrue(default_storage.exists(path))
+
+
+class SimilarRecipesTests(TestCase):
+    def setUp(self):
+        author = create_user('author')
+        salt, flour, sugar, pepper = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'мука', 'сахар', 'перец')
+        )
+        self.pie = create_recipe(
+            author, 'Пирог', [(salt, 5), (flour, 500), (sugar, 100)]
+        )
+        self.cake = create_recipe(
+            author, 'Кекс', [(salt, 1), (flour, 200), (sugar, 150)]
+        )
+        self.bread = create_recipe(author, 'Хлеб', [(salt, 5), (flour, 500)])
+        self.steak = create_recipe(author, 'Стейк', [(pepper, 2)])
+
+    def test_neighbors_are_ranked_by_score(self):
+        cosine = dict(compute_neighbors(2))
+        self.assertEqual(
+            [neighbor for neighbor, _ in cosine[self.pie.pk]],
+            [self.cake.pk, self.bread.pk]
+        )
+        self.assertAlmostEqual(cosine[self.pie.pk][0][1], 1, places=5)
+        self.assertAlmostEqual(
+            cosine[self.pie.pk][1][1], 2 / 6 ** 0.5, places=5
+        )
+        self.assertEqual(cosine[self.steak.pk], [])
+
+        jaccard = dict(compute_neighbors(2, 'jaccard'))
+        self.assertAlmostEqual(jaccard[self.bread.pk][0][1], 2 / 3)
+
+        # The pie and the cake share every ingredient but not the amounts.
+        weighted = dict(compute_neighbors(1, weighted=True))
+        self.assertEqual(weighted[self.pie.pk][0][0], self.cake.pk)
+        self.assertLess(weighted[self.pie.pk][0][1], 0.99)
+
+    def test_partial_rebuild_and_endpoint(self):
+        call_command(
+            'build_similar_recipes', '--top-k', '2', stdout=StringIO()
+        )
+        self.bread.recipe_ingredients.all().delete()
+        call_command(
+            'build_similar_recipes', '--recipe', str(self.pie.pk),
+            stdout=StringIO()
+        )
+        client = APIClient()
+
+        def similar(recipe_id):
+            response = client.get(f'/api/recipes/{recipe_id}/similar/')
+            if response.status_code != 200:
+                return response.status_code
+            return [recipe['id'] for recipe in response.data]
+
+        self.assertEqual(similar(self.pie.pk), [self.cake.pk])
+        self.assertEqual(
+            similar(self.cake.pk), [self.pie.pk, self.bread.pk]
+        )
+        self.assertEqual(similar(self.steak.pk), [])
+        self.assertEqual(similar(self.steak.pk + 100), 404)
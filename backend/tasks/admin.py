@@ -0,0 +1,21 @@
+from django.contrib import admin
+
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'name', 'status', 'attempts', 'max_attempts', 'run_at',
+        'locked_by'
+    )
+    list_filter = ('status', 'name')
+    search_fields = ('name',)
+    readonly_fields = ('locked_at', 'locked_by', 'last_error', 'created_at')
+    actions = ('requeue',)
+
+    @admin.action(description='Поставить в очередь заново')
+    def requeue(self, request, queryset):
+        queryset.exclude(status=Task.Status.RUNNING).update(
+            status=Task.Status.QUEUED, attempts=0, last_error=''
+        )
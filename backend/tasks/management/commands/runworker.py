@@ -0,0 +1,70 @@
+import signal
+from threading import Event, Thread
+
+from django.core.management.base import BaseCommand, CommandError
+from tasks.worker import (
+    Worker,
+    requeue_stale_tasks,
+    schedule_periodic_tasks,
+    worker_name,
+)
+
+
+class Command(BaseCommand):
+    help = 'Запускает обработчик фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Количество параллельных потоков'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Пауза между опросами пустой очереди, с'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить готовые задачи и завершиться'
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency должен быть больше нуля.')
+        stop = Event()
+
+        def shutdown(signum, frame):
+            self.stdout.write('Завершаем текущие задачи...')
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        requeue_stale_tasks()
+        schedule_periodic_tasks()
+        workers = [
+            Worker(worker_name(number), options['poll_interval'], stop)
+            for number in range(options['concurrency'])
+        ]
+        results = [0] * len(workers)
+
+        def work(number):
+            results[number] = workers[number].work(options['once'])
+
+        threads = [
+            Thread(target=work, args=(number,))
+            for number in range(len(workers))
+        ]
+        for thread in threads:
+            thread.start()
+        # Joining with a timeout keeps the main thread responsive to signals.
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+        self.stdout.write(
+            self.style.SUCCESS(f'Обработано задач: {sum(results)}.')
+        )
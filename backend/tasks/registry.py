@@ -0,0 +1,28 @@
+from django.utils import timezone
+
+from .models import Task
+
+TASKS = {}
+PERIODIC_TASKS = {}
+
+
+def task(max_attempts=3, retry_delay=60, every=None):
+    def decorator(func):
+        name = f'{func.__module__}.{func.__name__}'
+        TASKS[name] = (func, retry_delay)
+
+        def enqueue(run_at=None, **kwargs):
+            # Uses the caller's connection, so the task is only visible to
+            # workers once the surrounding transaction commits.
+            return Task.objects.create(
+                name=name,
+                kwargs=kwargs,
+                max_attempts=max_attempts,
+                run_at=run_at or timezone.now()
+            )
+
+        func.enqueue = enqueue
+        if every is not None:
+            PERIODIC_TASKS[name] = (enqueue, every)
+        return func
+    return decorator
@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from recipes.images import RECIPE_IMAGE_SIZES
+from recipes.tasks import (
+    reclaim_media,
+    reconcile_counters,
+    render_image_variants,
+)
+
+from .models import Task
+from .registry import PERIODIC_TASKS
+from .worker import run_pending_tasks, schedule_periodic_tasks
+
+
+class RunPendingTasksTests(TestCase):
+    def test_finished_tasks_are_deleted(self):
+        task = render_image_variants.enqueue(name='', sizes={})
+        self.assertEqual(run_pending_tasks(), 1)
+        self.assertFalse(Task.objects.filter(pk=task.pk).exists())
+        self.assertFalse(Task.objects.exists())
+
+    def test_periodic_tasks_keep_one_future_run(self):
+        schedule_periodic_tasks()
+        schedule_periodic_tasks()
+        names = {
+            f'{func.__module__}.{func.__name__}'
+            for func in (reconcile_counters, reclaim_media)
+        }
+        self.assertLessEqual(names, set(PERIODIC_TASKS))
+        self.assertEqual(
+            sorted(Task.objects.values_list('name', flat=True)),
+            sorted(PERIODIC_TASKS)
+        )
+        self.assertEqual(run_pending_tasks(), 0)
+
+        first = reconcile_counters.enqueue()
+        self.assertEqual(run_pending_tasks(), 1)
+        self.assertFalse(Task.objects.filter(pk=first.pk).exists())
+        self.assertEqual(
+            Task.objects.filter(name__in=names).count(), len(names)
+        )
+        self.assertFalse(Task.objects.filter(
+            run_at__lte=timezone.now()
+        ).exists())
+
+    def test_failed_tasks_are_retried_later_or_marked_failed(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            retried = render_image_variants.enqueue(
+                name='recipes/missing.jpg', sizes=RECIPE_IMAGE_SIZES
+            )
+            unknown = Task.objects.create(name='tasks.missing')
+            with self.assertLogs('tasks.worker', 'ERROR') as logs:
+                self.assertEqual(run_pending_tasks(), 2)
+        self.assertEqual(len(logs.records), 2)
+        retried.refresh_from_db()
+        unknown.refresh_from_db()
+        self.assertEqual(retried.status, Task.Status.QUEUED)
+        self.assertEqual(retried.attempts, 1)
+        self.assertGreater(retried.run_at, timezone.now())
+        self.assertIn('FileNotFoundError', retried.last_error)
+        self.assertEqual(unknown.status, Task.Status.FAILED)
+        self.assertEqual(run_pending_tasks(), 0)
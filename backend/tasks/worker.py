@@ -0,0 +1,131 @@
+import logging
+import os
+import socket
+import traceback
+from datetime import timedelta
+from threading import Event
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+from .registry import PERIODIC_TASKS, TASKS
+
+logger = logging.getLogger(__name__)
+
+LOCK_TIMEOUT = timedelta(minutes=30)
+
+
+def worker_name(number=0):
+    return f'{socket.gethostname()}:{os.getpid()}:{number}'
+
+
+def requeue_stale_tasks():
+    stale = Task.objects.filter(
+        status=Task.Status.RUNNING,
+        locked_at__lt=timezone.now() - LOCK_TIMEOUT
+    )
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.Status.FAILED,
+        last_error='Обработчик не завершил задачу вовремя.'
+    )
+    return stale.update(
+        status=Task.Status.QUEUED,
+        locked_at=None,
+        locked_by=''
+    )
+
+
+def schedule_periodic_tasks(names=None):
+    # Every periodic task keeps a single queued row that is re-enqueued when
+    # the previous run ends. Two workers starting together may both add one,
+    # but the next runs see the other row and the duplicate dies out.
+    now = timezone.now()
+    for name, (enqueue, every) in PERIODIC_TASKS.items():
+        if names is not None and name not in names:
+            continue
+        if not Task.objects.filter(
+            name=name, status__in=(Task.Status.QUEUED, Task.Status.RUNNING)
+        ).exists():
+            enqueue(run_at=now + every)
+
+
+class Worker:
+    def __init__(self, name, poll_interval=1.0, stop=None):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.stop = stop or Event()
+
+    def claim(self):
+        now = timezone.now()
+        with transaction.atomic():
+            task = Task.objects.select_for_update(skip_locked=True).filter(
+                status=Task.Status.QUEUED,
+                run_at__lte=now
+            ).order_by('run_at', 'id').first()
+            if task is None:
+                return None
+            task.status = Task.Status.RUNNING
+            task.locked_at = now
+            task.locked_by = self.name
+            task.attempts += 1
+            task.save(update_fields=[
+                'status', 'locked_at', 'locked_by', 'attempts'
+            ])
+        return task
+
+    def run(self, task):
+        func, retry_delay = TASKS.get(task.name, (None, 0))
+        try:
+            if func is None:
+                raise LookupError(f'Задача {task.name} не зарегистрирована.')
+            func(**task.kwargs)
+        except Exception:
+            logger.exception('Задача %s #%s завершилась ошибкой', task.name,
+                             task.pk)
+            retry = func is not None and task.attempts < task.max_attempts
+            Task.objects.filter(pk=task.pk).update(
+                status=Task.Status.QUEUED if retry else Task.Status.FAILED,
+                run_at=timezone.now() + timedelta(
+                    seconds=retry_delay * 2 ** (task.attempts - 1)
+                ) if retry else task.run_at,
+                locked_at=None,
+                locked_by='',
+                last_error=traceback.format_exc()
+            )
+            if not retry:
+                schedule_periodic_tasks([task.name])
+            return False
+        Task.objects.filter(pk=task.pk).delete()
+        schedule_periodic_tasks([task.name])
+        return True
+
+    def work(self, once=False):
+        processed = 0
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                task = self.claim()
+                if task is None:
+                    if once:
+                        break
+                    requeue_stale_tasks()
+                    self.stop.wait(self.poll_interval)
+                    continue
+                self.run(task)
+                processed += 1
+        finally:
+            connection.close()
+        return processed
+
+
+def run_pending_tasks():
+    # Runs everything that is due in the current thread, for tests and
+    # one-off invocations.
+    processed = 0
+    worker = Worker(worker_name())
+    while (task := worker.claim()) is not None:
+        worker.run(task)
+        processed += 1
+    return processed
@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.utils.safestring import mark_safe
 
 from .models import CustomUser, Subscriptions
+from recipes.images import AVATAR_SIZES, variant_url
 from recipes.models import FavoriteRecipes, ShoppingCart
 
 
@@ -49,20 +50,21 @@ class CustomUserAdmin(admin.ModelAdmin):
     @mark_safe
     def get_avatar_preview(self, obj):
         if obj.avatar:
-            return f'<img src="{obj.avatar.url}" width="50" height="50">'
+            url = variant_url(obj.avatar, AVATAR_SIZES, 'small')
+            return f'<img src="{url}" width="50" height="50">'
         return '-'
 
     @admin.display(description='Рецептов')
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     @admin.display(description='Подписок')
     def get_subscriptions_count(self, obj):
-        return obj.subscriptions.count()
+        return obj.subscriptions_count
 
     @admin.display(description='Подписчиков')
     def get_subscribers_count(self, obj):
-        return obj.subscribers.count()
+        return obj.subscribers_count
 
     fieldsets = (
         ('About User', {
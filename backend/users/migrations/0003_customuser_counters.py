@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-18 20:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subscriptions(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Subscriptions = apps.get_model('users', 'Subscriptions')
+    for field, fk_field in (
+        ('subscribers_count', 'subscribe'),
+        ('subscriptions_count', 'user'),
+    ):
+        CustomUser.objects.update(**{field: Coalesce(Subquery(
+            Subscriptions.objects.filter(
+                **{fk_field: OuterRef('pk')}
+            ).order_by().values(fk_field).annotate(
+                count=Count('pk')
+            ).values('count')
+        ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = (
+        ('users', '0002_remove_customuser_favorite_recipes_and_more'),
+    )
+
+    operations = (
+        migrations.AddField(
+            model_name='customuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='subscriptions_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписок'),
+        ),
+        migrations.RunPython(count_subscriptions, migrations.RunPython.noop),
+    )
@@ -1,12 +1,45 @@
 from django.db import models
-from django.db.models import Q, F
+from django.db.models import Exists, F, OuterRef, Q, Value
 from django.core.validators import RegexValidator
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 
 from . import constants
 
 
-class CustomUser(AbstractUser):
+class DenormalizedCountersMixin:
+    # The counters are changed in the database with F() updates, so the
+    # values an instance loaded earlier holds are left out of the UPDATE of
+    # a plain save(). Everything else about save() is unchanged: signals see
+    # update_fields=None, a deleted row is inserted again, and a counter
+    # named in update_fields is written.
+    counter_fields = ()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+                   forced_update):
+        if update_fields is None:
+            values = [
+                value for value in values
+                if value[0].name not in self.counter_fields
+            ]
+        return super()._do_update(
+            base_qs, using, pk_val, values, update_fields, forced_update
+        )
+
+
+class CustomUserQuerySet(models.QuerySet):
+    def with_is_subscribed(self, user):
+        if not user.is_authenticated:
+            return self.annotate(is_subscribed=Value(False))
+        return self.annotate(is_subscribed=Exists(Subscriptions.objects.filter(
+            user=user, subscribe=OuterRef('pk')
+        )))
+
+
+class CustomUserManager(UserManager.from_queryset(CustomUserQuerySet)):
+    pass
+
+
+class CustomUser(DenormalizedCountersMixin, AbstractUser):
     email = models.EmailField(
         unique=True,
         max_length=constants.EMAIL_MAX_LENGTH,
@@ -34,6 +67,29 @@ class CustomUser(AbstractUser):
         null=True,
         verbose_name='Аватар'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов'
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков'
+    )
+    subscriptions_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписок'
+    )
+
+    objects = CustomUserManager()
+
+    counter_fields = (
+        'recipes_count',
+        'subscribers_count',
+        'subscriptions_count'
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
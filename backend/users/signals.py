@@ -0,0 +1,42 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CustomUser, Subscriptions
+
+bulk_counters = ContextVar('bulk_counters', default=False)
+
+
+@contextmanager
+def counters_updated_in_bulk():
+    token = bulk_counters.set(True)
+    try:
+        yield
+    finally:
+        bulk_counters.reset(token)
+
+
+def change_subscription_counters(subscription, delta):
+    if bulk_counters.get():
+        return
+    CustomUser.objects.filter(pk=subscription.user_id).update(
+        subscriptions_count=Greatest(F('subscriptions_count') + delta, 0)
+    )
+    CustomUser.objects.filter(pk=subscription.subscribe_id).update(
+        subscribers_count=Greatest(F('subscribers_count') + delta, 0)
+    )
+
+
+@receiver(post_save, sender=Subscriptions)
+def increase_subscription_counters(sender, instance, created, **kwargs):
+    if created:
+        change_subscription_counters(instance, 1)
+
+
+@receiver(post_delete, sender=Subscriptions)
+def decrease_subscription_counters(sender, instance, **kwargs):
+    change_subscription_counters(instance, -1)
@@ -0,0 +1,502 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import ssl
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from statistics import quantiles
+from urllib.parse import quote, urlsplit
+
+
+COLLECTION = Path(__file__).with_name('foodgram.postman_collection.json')
+VARIABLE = re.compile(r'{{(\w+)}}')
+HISTOGRAM_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+LOGIN = ('get_token_for_first_user', 'users_me // User')
+REGISTER = ('create_first_user',) + LOGIN
+# Steps are request names from the collection; the first request with a given
+# name is used.
+SCENARIOS = {
+    'browse': (6, False, (
+        'get_recipes_list // No Auth',
+        'get_recipe_detail // No Auth',
+        'get_recipe_short_link // No Auth',
+        'get_ingredients_list // No Auth',
+    )),
+    'shopper': (3, True, (
+        'get_recipes_list // User',
+        'add_to_favorite // User',
+        'add_to_shopping_cart // User',
+        'get_recipes_list_with_is_in_shopping_cart_param // User',
+        'download_shopping_cart // User',
+        'remove_from_shopping_cart // User',
+        'remove_from_favorite // User',
+    )),
+    'author': (1, True, (
+        'get_ingredients_list_with_name_filter // User',
+        'create_first_recipe // Second User',
+        'update_recipe // Second User',
+        'get_recipe_detail // User',
+        'delete_first_recipe // Second User',
+    )),
+    'follower': (2, True, (
+        'create_subscription // User',
+        'get_subscription_list_with_recipes_limit_param // User',
+        'delete_first_subscription // User',
+    )),
+    'register': (1, False, REGISTER + ('logout // User',)),
+}
+# Response fields stored into variables, mirroring the collection's test
+# scripts.
+CAPTURES = {
+    'create_first_user': {'userId': 'id'},
+    'get_token_for_first_user': {
+        'userToken': 'auth_token',
+        'secondUserToken': 'auth_token',
+    },
+    'users_me // User': {'userId': 'id'},
+    'create_first_recipe // Second User': {'firstRecipeId': 'id'},
+}
+
+
+class Step:
+    def __init__(self, item, auth):
+        request = item['request']
+        auth = request.get('auth', auth) or {}
+        self.name = item['name']
+        self.method = request['method']
+        self.url = request['url']['raw']
+        self.body = (request.get('body') or {}).get('raw') or None
+        self.token = None
+        if auth.get('type') == 'apikey':
+            value = next(
+                entry['value'] for entry in auth['apikey']
+                if entry['key'] == 'value'
+            )
+            self.token = VARIABLE.search(value).group(1)
+
+
+def load_steps(path):
+    with open(path, encoding='utf-8') as file:
+        collection = json.load(file)
+    steps = {}
+
+    def walk(items, auth):
+        for item in items:
+            item_auth = item.get('auth', auth)
+            if 'item' in item:
+                walk(item['item'], item_auth)
+            else:
+                steps.setdefault(item['name'], Step(item, item_auth))
+
+    walk(collection['item'], collection.get('auth'))
+    variables = {
+        variable['key']: variable['value']
+        for variable in collection.get('variable', ())
+    }
+    return steps, variables
+
+
+def render(template, variables, escape=False):
+    def replace(match):
+        value = str(variables[match.group(1)])
+        return quote(value, safe='') if escape else value
+    return VARIABLE.sub(replace, template)
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Connection:
+    # A minimal keep-alive HTTP/1.1 client, enough for the API's JSON and
+    # streamed file responses.
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.secure = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.secure else 80)
+        self.host_header = parts.netloc
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers, body=None):
+        return await asyncio.wait_for(
+            self.send(method, path, headers, body), self.timeout
+        )
+
+    async def send(self, method, path, headers, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port,
+                ssl=ssl.create_default_context() if self.secure else None
+            )
+        payload = body.encode() if body is not None else b''
+        lines = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host_header}',
+            'Accept: */*',
+            f'Content-Length: {len(payload)}',
+            *(f'{key}: {value}' for key, value in headers.items()),
+        ]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise HTTPError('соединение закрыто сервером')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            key, _, value = line.decode('latin-1').partition(':')
+            response_headers[key.strip().lower()] = value.strip()
+        content = await self.read_body(method, status, response_headers)
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, content
+
+    async def read_body(self, method, status, headers):
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            return b''
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while size := int((await self.reader.readline()).split(b';')[0],
+                              16):
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            while await self.reader.readline() not in (b'\r\n', b''):
+                pass
+            return b''.join(chunks)
+        if 'content-length' in headers:
+            return await self.reader.readexactly(
+                int(headers['content-length'])
+            )
+        content = await self.reader.read()
+        await self.close()
+        return content
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.scenarios = defaultdict(lambda: defaultdict(int))
+        self.delayed = 0
+
+    def record(self, step, latency, status):
+        self.latencies[step].append(latency)
+        self.statuses[step][status] += 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors[step] += 1
+
+
+class LoadTest:
+    def __init__(self, options, steps, variables):
+        self.options = options
+        self.steps = steps
+        self.variables = variables
+        self.stats = Stats()
+        self.random = random.Random(options.seed)
+
+    async def prepare(self):
+        connection = Connection(self.options.base_url, self.options.timeout)
+        try:
+            status, content = await connection.request(
+                'GET', '/api/ingredients/', {}
+            )
+            ingredients = json.loads(content) if status == 200 else []
+            status, content = await connection.request(
+                'GET', '/api/recipes/?limit=100', {}
+            )
+            recipes = json.loads(content)['results'] if status == 200 else []
+        finally:
+            await connection.close()
+        if len(ingredients) < 2 or not recipes:
+            raise SystemExit(
+                'В базе нужны хотя бы два ингредиента и один рецепт, '
+                'заполните её командой seed.'
+            )
+        self.ingredients = ingredients
+        self.recipes = [(recipe['id'], recipe['author']['id'])
+                        for recipe in recipes]
+
+    def user_variables(self, register):
+        first, second = self.random.sample(self.ingredients, 2)
+        recipe_id, author_id = self.random.choice(self.recipes)
+        variables = {
+            **self.variables,
+            'baseUrl': '',
+            'firstIndredientId': first['id'],
+            'secondIndredientId': second['id'],
+            'ingredientNameFirstLatter': first['name'][:1],
+            'firstRecipeId': recipe_id,
+            'thirdUserId': author_id,
+        }
+        if not register:
+            number = self.random.randrange(self.options.seed_users)
+            email = f'{self.options.seed_prefix}{number}@example.com'
+            password = self.options.seed_password
+        else:
+            name = f'load-{uuid.uuid4().hex[:12]}'
+            email = f'{name}@example.com'
+            password = f'Load-{uuid.uuid4().hex}'
+            variables['username'] = json.dumps(name)
+        variables['email'] = json.dumps(email)
+        variables['password'] = json.dumps(password)
+        return variables
+
+    async def run_step(self, connection, name, variables):
+        step = self.steps[name]
+        headers = {}
+        if step.body is not None:
+            headers['Content-Type'] = 'application/json'
+        if step.token is not None:
+            headers['Authorization'] = f'Token {variables[step.token]}'
+        path = render(step.url, variables, escape=True)
+        body = render(step.body, variables) if step.body else None
+        start = time.perf_counter()
+        try:
+            status, content = await connection.request(
+                step.method, path, headers, body
+            )
+        except (OSError, asyncio.TimeoutError, HTTPError, ValueError) as error:
+            await connection.close()
+            self.stats.record(name, time.perf_counter() - start,
+                              type(error).__name__)
+            return False
+        self.stats.record(name, time.perf_counter() - start, status)
+        if status >= 400:
+            return False
+        for variable, field in CAPTURES.get(name, {}).items():
+            variables[variable] = json.loads(content)[field]
+        return True
+
+    async def run_user(self, scenario):
+        _, needs_login, steps = SCENARIOS[scenario]
+        register = scenario == 'register' or not self.options.seed_users
+        if needs_login:
+            steps = (REGISTER if register else LOGIN) + steps
+        variables = self.user_variables(register)
+        connection = Connection(self.options.base_url, self.options.timeout)
+        completed = False
+        try:
+            for number, name in enumerate(steps):
+                if number and self.options.think_time:
+                    await asyncio.sleep(self.random.expovariate(
+                        1 / self.options.think_time
+                    ))
+                # Later steps depend on the state the failed one should have
+                # created, so the flow stops here.
+                if not await self.run_step(connection, name, variables):
+                    break
+            else:
+                completed = True
+        finally:
+            await connection.close()
+        self.stats.scenarios[scenario]['completed' if completed
+                                       else 'failed'] += 1
+
+    async def run(self):
+        await self.prepare()
+        names = list(self.options.scenarios)
+        weights = [self.options.scenarios[name] for name in names]
+        slots = asyncio.Semaphore(self.options.max_users)
+        tasks = set()
+
+        async def user(scenario):
+            async with slots:
+                await self.run_user(scenario)
+
+        start = time.perf_counter()
+        deadline = start + self.options.duration
+        while time.perf_counter() < deadline:
+            # Poisson arrivals: exponential gaps between new virtual users.
+            await asyncio.sleep(
+                self.random.expovariate(self.options.rate)
+            )
+            if slots.locked():
+                self.stats.delayed += 1
+            scenario = self.random.choices(names, weights)[0]
+            task = asyncio.create_task(user(scenario))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        return time.perf_counter() - start
+
+
+def percentile(latencies, fraction):
+    if len(latencies) == 1:
+        return latencies[0]
+    return quantiles(latencies, n=100, method='inclusive')[
+        round(fraction * 100) - 1
+    ]
+
+
+def histogram(latencies):
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for latency in latencies:
+        counts[sum(latency * 1000 > bound
+                   for bound in HISTOGRAM_BOUNDS_MS)] += 1
+    labels = [f'<={bound}' for bound in HISTOGRAM_BOUNDS_MS]
+    labels.append(f'>{HISTOGRAM_BOUNDS_MS[-1]}')
+    return dict(zip(labels, counts))
+
+
+def summarize(stats, elapsed):
+    steps = {}
+    for name, latencies in stats.latencies.items():
+        steps[name] = {
+            'requests': len(latencies),
+            'rps': round(len(latencies) / elapsed, 2),
+            'error_rate': round(stats.errors[name] / len(latencies), 4),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2),
+            'statuses': {
+                str(status): count
+                for status, count in stats.statuses[name].items()
+            },
+            'histogram_ms': histogram(latencies),
+        }
+    total = sum(step['requests'] for step in steps.values())
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'requests': total,
+        'rps': round(total / elapsed, 2),
+        'error_rate': round(
+            sum(stats.errors.values()) / total, 4
+        ) if total else 0,
+        'delayed_users': stats.delayed,
+        'scenarios': {
+            name: dict(counts) for name, counts in stats.scenarios.items()
+        },
+        'steps': steps,
+    }
+
+
+def print_report(report):
+    print(
+        f'Время: {report["elapsed_s"]} с, запросов: {report["requests"]}, '
+        f'{report["rps"]} запр/с, ошибок: {report["error_rate"]:.2%}, '
+        f'отложенных пользователей: {report["delayed_users"]}'
+    )
+    for name, counts in report['scenarios'].items():
+        print(f'  {name}: {counts}')
+    width = max(map(len, report['steps']), default=0)
+    print(
+        f'{"Шаг":<{width}}  '
+        'запр  запр/с  ошибки    p50    p95    p99    max'
+    )
+    for name, step in report['steps'].items():
+        print(
+            f'{name:<{width}}  {step["requests"]:>4}  {step["rps"]:>6}  '
+            f'{step["error_rate"]:>6.1%} {step["p50_ms"]:>6.0f} '
+            f'{step["p95_ms"]:>6.0f} {step["p99_ms"]:>6.0f} '
+            f'{step["max_ms"]:>6.0f}'
+        )
+    print('Гистограммы задержек, мс:')
+    for name, step in report['steps'].items():
+        buckets = ' '.join(
+            f'{label}:{count}'
+            for label, count in step['histogram_ms'].items() if count
+        )
+        print(f'  {name}: {buckets}')
+
+
+def parse_scenarios(values):
+    if not values:
+        return {name: weight for name, (weight, _, _) in SCENARIOS.items()}
+    scenarios = {}
+    for value in values:
+        name, _, weight = value.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(
+                f'Неизвестный сценарий {name}, доступны: '
+                f'{", ".join(SCENARIOS)}'
+            )
+        scenarios[name] = float(weight) if weight else SCENARIOS[name][0]
+    return scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Нагрузочное тестирование API по сценариям '
+                    'postman-коллекции'
+    )
+    parser.add_argument('--collection', default=COLLECTION,
+                        help='Файл postman-коллекции')
+    parser.add_argument('--base-url',
+                        help='Адрес бэкенда, по умолчанию baseUrl коллекции')
+    parser.add_argument('--scenario', action='append', dest='scenario_list',
+                        metavar='ИМЯ[=ВЕС]',
+                        help='Сценарий и его вес (можно указать несколько '
+                             f'раз): {", ".join(SCENARIOS)}')
+    parser.add_argument('--rate', type=float, default=5,
+                        help='Новых виртуальных пользователей в секунду')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='Длительность подачи нагрузки, с')
+    parser.add_argument('--max-users', type=int, default=200,
+                        help='Максимум одновременных пользователей')
+    parser.add_argument('--think-time', type=float, default=1.0,
+                        help='Средняя пауза между шагами, с (0 — без пауз)')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='Таймаут одного запроса, с')
+    parser.add_argument('--seed-users', type=int, default=0,
+                        help='Входить под пользователями команды seed '
+                             'вместо регистрации новых')
+    parser.add_argument('--seed-prefix', default='seed',
+                        help='Префикс логинов пользователей команды seed')
+    parser.add_argument('--seed-password', default='seed-password',
+                        help='Пароль пользователей команды seed')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Зерно генератора случайных чисел')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='Доля ошибок, при превышении которой скрипт '
+                             'завершается с кодом 1')
+    parser.add_argument('--output', help='Сохранить отчёт в JSON-файл')
+    options = parser.parse_args()
+    if options.rate <= 0 or options.max_users < 1:
+        parser.error('--rate и --max-users должны быть больше нуля')
+    try:
+        options.scenarios = parse_scenarios(options.scenario_list)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
+
+    steps, variables = load_steps(options.collection)
+    required = set(REGISTER + LOGIN).union(
+        *(names for _, _, names in SCENARIOS.values())
+    )
+    missing = required - steps.keys()
+    if missing:
+        parser.error(f'В коллекции нет запросов: {", ".join(sorted(missing))}')
+    options.base_url = (options.base_url or variables['baseUrl']).rstrip('/')
+
+    load_test = LoadTest(options, steps, variables)
+    elapsed = asyncio.run(load_test.run())
+    report = summarize(load_test.stats, elapsed)
+    print_report(report)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    return int(report['error_rate'] > options.max_error_rate)
+
+
+if __name__ == '__main__':
+    sys.exit(main())